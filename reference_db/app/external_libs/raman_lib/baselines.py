@@ -0,0 +1,413 @@
+import hashlib
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from pybaselines.misc import beads
+from pybaselines.morphological import mormol, rolling_ball
+from pybaselines.whittaker import arpls, asls
+from scipy.linalg import get_lapack_funcs, solve_banded
+from scipy.special import expit
+
+try:
+    from . import jit_kernels
+except ImportError:  # numba is not installed or does not match NumPy
+    jit_kernels = None
+
+_MIN_FLOAT = np.finfo(float).eps
+# Below this many rows, one LAPACK call per row is faster than the batched
+# solver, whose cost is dominated by its Python loop over the points
+_BATCH_MIN_ROWS = 256
+
+
+@lru_cache(maxsize=32)
+def whittaker_penalty(npt, lam, diff_order=2):
+    """Build the penalty matrix lam * D.T @ D of the Whittaker smoother.
+
+    The matrix only depends on the number of points, lam and the difference
+    order, so it is cached and shared by all spectra of a dataset.
+
+    Args:
+        npt (int): Number of data points of each spectrum.
+        lam (float): Smoothing parameter.
+        diff_order (int, optional): Order of the difference matrix D. Defaults to 2.
+
+    Returns:
+        numpy.ndarray: Read-only penalty in the lower banded form used by
+            scipy.linalg.solveh_banded(lower=True), shape (diff_order + 1, npt).
+    """
+    coefs = np.diff(np.eye(diff_order + 1), diff_order, axis=0).ravel()
+    penalty = np.zeros((diff_order + 1, npt), order="F")
+    # Each row of D holds the same coefficients, so every diagonal of D.T @ D
+    # is a sum of coefficient products over the rows overlapping a point.
+    n_rows = npt - diff_order
+    for u in range(diff_order + 1):
+        for k in range(diff_order + 1 - u):
+            penalty[u, k:k + n_rows] += lam * coefs[k] * coefs[k + u]
+    penalty.flags.writeable = False
+    return penalty
+
+
+def _solve_banded_fallback(ab, b):
+    """Solve the system with a banded LU decomposition if it is not positive definite."""
+    bw = len(ab) - 1
+    ab_full = np.zeros((2 * bw + 1, ab.shape[1]))
+    ab_full[bw:] = ab
+    for u in range(1, bw + 1):
+        ab_full[bw - u, u:] = ab[u, :-u]
+    return solve_banded((bw, bw), ab_full, b, check_finite=False)
+
+
+def _solve_whittaker(penalty, weights, y):
+    """Solve (W + P) z = W y for one spectrum."""
+    ab = np.array(penalty, order="F")
+    ab[0] += weights
+    b = weights * y
+    pbsv, = get_lapack_funcs(("pbsv",), (ab, b))
+    _, z, info = pbsv(ab, b, lower=1, overwrite_ab=1)
+    if info != 0:
+        ab = np.array(penalty)
+        ab[0] += weights
+        z = _solve_banded_fallback(ab, b)
+    return z
+
+
+def _solve_whittaker_unweighted(penalty, Y):
+    """Solve (I + P) Z = Y for all rows of Y with a single factorization.
+
+    The triangular solves are done column by column, so the result for a row
+    does not depend on which other rows are solved with it.
+    """
+    ab = np.array(penalty, order="F")
+    ab[0] += 1
+    pbtrf, pbtrs = get_lapack_funcs(("pbtrf", "pbtrs"), (ab, Y))
+    cholesky, info = pbtrf(ab, lower=1, overwrite_ab=1)
+    if info != 0:
+        return np.array([_solve_whittaker(penalty, np.ones(len(y)), y)
+                         for y in Y])
+    Z, _ = pbtrs(cholesky, Y.T, lower=1)
+    return Z.T
+
+
+def _solve_whittaker_batch(penalty, W, Y):
+    """Solve (diag(w) + P) z = w * y for every row of W and Y.
+
+    Each system gets its own banded Cholesky decomposition, computed for
+    all rows at once: the loops run over the points of the spectra and
+    every step is an array operation across the rows. The result of a row
+    does not depend on the other rows. Rows whose system is not positive
+    definite are solved with _solve_whittaker.
+
+    Returns:
+        numpy.ndarray: Solutions with the same shape as Y.
+    """
+    bw = len(penalty) - 1
+    npt = Y.shape[1]
+    # Points along the first axes, so every step works on contiguous values
+    L = np.empty((bw + 1, npt, len(Y)))
+    L[:] = penalty[:, :, None]
+    L[0] += W.T
+    b = (W * Y).T.copy()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for j in range(npt):
+            for k in range(1, min(bw, j) + 1):
+                L[0, j] -= L[k, j - k]**2
+            np.sqrt(L[0, j], out=L[0, j])
+            for u in range(1, min(bw, npt - 1 - j) + 1):
+                for k in range(1, min(bw - u, j) + 1):
+                    L[u, j] -= L[u + k, j - k] * L[k, j - k]
+                L[u, j] /= L[0, j]
+
+        for j in range(npt):
+            for k in range(1, min(bw, j) + 1):
+                b[j] -= L[k, j - k] * b[j - k]
+            b[j] /= L[0, j]
+        for j in range(npt - 1, -1, -1):
+            for k in range(1, min(bw, npt - 1 - j) + 1):
+                b[j] -= L[k, j] * b[j + k]
+            b[j] /= L[0, j]
+
+    Z = b.T
+    failed = ~np.isfinite(Z).all(axis=1)
+    for i in np.flatnonzero(failed):
+        Z[i] = _solve_whittaker(penalty, W[i], Y[i])
+    return Z
+
+
+def _relative_difference(old, new):
+    return (np.linalg.norm(new - old, axis=1)
+            / np.maximum(np.linalg.norm(old, axis=1), _MIN_FLOAT))
+
+
+def _asls_weights(Y, baselines, p):
+    return np.where(Y > baselines, p, 1 - p), np.zeros(len(Y), dtype=bool)
+
+
+def _arpls_weights(Y, baselines):
+    residual = Y - baselines
+    neg = residual < 0
+    n_neg = neg.sum(axis=1)
+    exit_early = n_neg < 2
+
+    n_neg = np.maximum(n_neg, 2)
+    neg_residual = np.where(neg, residual, 0)
+    mean = neg_residual.sum(axis=1) / n_neg
+    std = np.sqrt((np.where(neg, residual - mean[:, None], 0)**2).sum(axis=1)
+                  / (n_neg - 1))
+    std[std == 0] = _MIN_FLOAT
+
+    weights = expit(-(2 / std[:, None])
+                    * (residual - (2 * std - mean)[:, None]))
+    return weights, exit_early
+
+
+def _reweighted_whittaker(X, lam, diff_order, max_iter, tol, weight_func):
+    """Run the iteratively reweighted Whittaker smoother on all rows of X.
+
+    All spectra share one cached penalty matrix. Each iteration solves the
+    banded systems of all spectra that have not converged yet together (see
+    _solve_whittaker_batch; once only a few are left, one by one) and then
+    updates their weights at once.
+    """
+    X = np.asarray(X, dtype=float)
+    bl = np.zeros_like(X)
+    if X.size == 0:
+        return bl
+
+    penalty = whittaker_penalty(X.shape[1], float(lam), diff_order)
+    weights = np.ones_like(X)
+    active = np.arange(len(X))
+
+    for it in range(max_iter + 1):
+        if it == 0:
+            # All weights start at 1, so the first system is the same for
+            # every spectrum and only needs to be factorized once.
+            bl[:] = _solve_whittaker_unweighted(penalty, X)
+        elif len(active) >= _BATCH_MIN_ROWS:
+            bl[active] = _solve_whittaker_batch(penalty, weights[active], X[active])
+        else:
+            for i in active:
+                bl[i] = _solve_whittaker(penalty, weights[i], X[i])
+
+        new_weights, exit_early = weight_func(X[active], bl[active])
+        diff = _relative_difference(weights[active], new_weights)
+        done = exit_early | (diff < tol)
+
+        weights[active[~done]] = new_weights[~done]
+        active = active[~done]
+        if len(active) == 0:
+            break
+
+    return bl
+
+
+def asls_batch(X, lam=1e6, p=1e-2, diff_order=2, max_iter=50, tol=1e-3):
+    """Asymmetric least squares baselines of all rows of X.
+
+    Batched equivalent of pybaselines.whittaker.asls with the same defaults.
+
+    Args:
+        X (numpy.ndarray): Spectra, one per row.
+
+    Returns:
+        numpy.ndarray: Baselines with the same shape as X.
+    """
+    if not 0 < p < 1:
+        raise ValueError("p must be between 0 and 1")
+    return _reweighted_whittaker(X, lam, diff_order, max_iter, tol,
+                                 lambda Y, bl: _asls_weights(Y, bl, p))
+
+
+def arpls_batch(X, lam=1e5, diff_order=2, max_iter=50, tol=1e-3):
+    """Asymmetrically reweighted penalized least squares baselines of all rows of X.
+
+    Batched equivalent of pybaselines.whittaker.arpls with the same defaults.
+
+    Args:
+        X (numpy.ndarray): Spectra, one per row.
+
+    Returns:
+        numpy.ndarray: Baselines with the same shape as X.
+    """
+    return _reweighted_whittaker(X, lam, diff_order, max_iter, tol,
+                                 _arpls_weights)
+
+
+def asls_jit(X, lam=1e6, p=1e-2, diff_order=2, max_iter=50, tol=1e-3):
+    """Numba-compiled asls baselines of all rows of X (requires numba)."""
+    X = np.ascontiguousarray(X, dtype=float)
+    penalty = np.ascontiguousarray(whittaker_penalty(X.shape[1], float(lam), diff_order))
+    return jit_kernels.whittaker_rows(X, penalty, 0, p, max_iter, tol)
+
+
+def arpls_jit(X, lam=1e5, diff_order=2, max_iter=50, tol=1e-3):
+    """Numba-compiled arpls baselines of all rows of X (requires numba)."""
+    X = np.ascontiguousarray(X, dtype=float)
+    penalty = np.ascontiguousarray(whittaker_penalty(X.shape[1], float(lam), diff_order))
+    return jit_kernels.whittaker_rows(X, penalty, 1, 0.0, max_iter, tol)
+
+
+def _per_row(bl_func):
+    """Wrap a pybaselines function to estimate the baselines of all rows of X."""
+    def fit_rows(X):
+        bl = np.zeros(np.shape(X))
+        for i, row in enumerate(X):
+            bl[i] = bl_func(row)[0]
+        return bl
+    return fit_rows
+
+
+# Available implementations ("backends") of each baseline method
+baseline_backends = {"asls": {"pybaselines": _per_row(asls), "native": asls_batch},
+                     "arpls": {"pybaselines": _per_row(arpls), "native": arpls_batch},
+                     "mormol": {"pybaselines": _per_row(mormol)},
+                     "rolling ball": {"pybaselines": _per_row(rolling_ball)},
+                     "beads": {"pybaselines": _per_row(beads)}}
+
+if jit_kernels is not None:
+    baseline_backends["asls"]["numba"] = asls_jit
+    baseline_backends["arpls"]["numba"] = arpls_jit
+
+# Throughput in spectra per second of each backend, by (method, n_features)
+benchmark_results = {}
+
+
+def register_backend(method, name, func):
+    """Add an implementation of a (new or existing) baseline method.
+
+    Args:
+        method (str): Name of the baseline method.
+        name (str): Name of the backend.
+        func (callable): Takes a 2D array of spectra and returns their baselines.
+    """
+    baseline_backends.setdefault(method, {})[name] = func
+    for key in [key for key in benchmark_results if key[0] == method]:
+        del benchmark_results[key]
+
+
+def fit_baselines(X, method, backend="pybaselines"):
+    """Estimate the baseline of each row of X with the given method and backend."""
+    return baseline_backends[method][backend](X)
+
+
+def fit_single_threaded(func, X):
+    """Run a backend function on X in a worker process.
+
+    The workers already occupy all cores, so the parallel numba kernels are
+    limited to one thread (the limit applies to the calling thread only).
+    Backends are passed as functions rather than names, as the registry of a
+    worker process does not hold backends added with register_backend.
+    """
+    if jit_kernels is not None:
+        from numba import set_num_threads
+        set_num_threads(1)
+    return func(X)
+
+
+def benchmark_backends(X, method, n_rows=32, repeats=3):
+    """Measure the throughput of all backends of a method on a sample of X.
+
+    The results are stored in benchmark_results.
+
+    Args:
+        X (array-like): Spectra, one per row.
+        method (str): Name of the baseline method.
+        n_rows (int, optional): Number of spectra used for the benchmark. Defaults to 32.
+        repeats (int, optional): Number of timed runs per backend, the fastest one counts. Defaults to 3.
+
+    Returns:
+        dict: Spectra per second of each backend.
+    """
+    sample = np.asarray(X, dtype=float)[:n_rows]
+    timings = {}
+    for name, func in baseline_backends[method].items():
+        func(sample[:1])  # warm-up, e.g. JIT compilation
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func(sample)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = len(sample) / max(best, _MIN_FLOAT)
+
+    benchmark_results[(method, sample.shape[1])] = timings
+    return timings
+
+
+def select_backend(X, method):
+    """Fastest backend of a method for spectra like X, benchmarked on first use."""
+    if len(baseline_backends[method]) == 1:
+        return next(iter(baseline_backends[method]))
+
+    key = (method, np.shape(X)[1])
+    if key not in benchmark_results:
+        benchmark_backends(X, method)
+    timings = benchmark_results[key]
+    return max(timings, key=timings.get)
+
+
+class BaselineCache:
+    """Memory-bounded LRU store of estimated baselines.
+
+    Baselines are stored per spectrum and keyed by a hash of the spectrum's
+    content together with the method and its parameters, so the same
+    spectrum is only corrected once even across separate calls, e.g. when
+    sweeping scoring parameters.
+
+    Args:
+        max_bytes (int, optional): Memory budget for the stored baselines.
+            The least recently used entries are evicted once it is exceeded.
+            Defaults to 256 MiB.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._store = OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    @staticmethod
+    def make_keys(X, method, **params):
+        """Create one cache key per row of X."""
+        X = np.ascontiguousarray(X, dtype=float)
+        params = tuple(sorted(params.items()))
+        return [(hashlib.blake2b(row.tobytes(), digest_size=16).digest(),
+                 method, params) for row in X]
+
+    def get(self, key):
+        """Return the stored baseline for key, or None if there is none."""
+        try:
+            baseline = self._store[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._store.move_to_end(key)
+        self.hits += 1
+        return baseline
+
+    def put(self, key, baseline):
+        """Store a baseline, evicting the least recently used ones if needed."""
+        baseline = np.array(baseline, dtype=float)
+        if baseline.nbytes > self.max_bytes:
+            return
+        baseline.flags.writeable = False
+
+        if key in self._store:
+            self.nbytes -= self._store.pop(key).nbytes
+        self._store[key] = baseline
+        self.nbytes += baseline.nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._store.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        self._store.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
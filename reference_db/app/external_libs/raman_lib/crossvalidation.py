@@ -145,26 +145,244 @@
 
 from collections import defaultdict
 import os
+import re
 import sys
 import logging
+import time
+import warnings
 
 import numpy as np
 import pandas as pd
-from mlxtend.evaluate import mcnemar, mcnemar_table
+from joblib import Parallel, delayed, dump, load
+from joblib import hash as joblib_hash
 from sklearn.base import (BaseEstimator, MetaEstimatorMixin, clone,
                           is_classifier)
 from sklearn.dummy import DummyClassifier, DummyRegressor
-from sklearn.model_selection import (GridSearchCV, KFold, ParameterGrid,
-                                     StratifiedKFold, cross_val_predict,
-                                     cross_validate)
+from sklearn.exceptions import FitFailedWarning
+from sklearn.metrics import check_scoring, get_scorer
+from sklearn.model_selection import (KFold, ParameterGrid,
+                                     StratifiedKFold, cross_val_predict)
 from sklearn.pipeline import Pipeline
-from tqdm.autonotebook import tqdm
+from sklearn.utils import resample
 
 from .misc import mode
+from .preprocessing import is_rowwise
+from .results import mcnemar_tables, mcnemar_tests
 
 cv_logger = logging.getLogger(__name__)
 
+
+def _get_scorers(estimator, scoring):
+    """Scorers by metric name. A single metric is named "score", as in GridSearchCV."""
+    if scoring is None or isinstance(scoring, str) or callable(scoring):
+        return {"score": check_scoring(estimator, scoring=scoring)}
+    if isinstance(scoring, dict):
+        return {name: get_scorer(scorer) if isinstance(scorer, str) else scorer
+                for name, scorer in scoring.items()}
+    return {name: get_scorer(name) for name in scoring}
+
+
+def _fit_and_score(estimator, params, X, y, train, test, scorers,
+                   return_estimator=False, error_score="raise"):
+    """Fit a clone of estimator with params on train and score it on train and test.
+
+    If the fit fails and error_score is not "raise", all scores are set to
+    error_score (as with GridSearchCV) and the error message is returned
+    under "fit_error", so the caller can warn about it.
+
+    Returns:
+        dict: Train and test score per metric, fit and score time and, if return_estimator, the fitted estimator.
+    """
+    estimator = clone(estimator).set_params(**params)
+    X_train, y_train = X[train], y[train]
+    X_test, y_test = X[test], y[test]
+
+    start = time.perf_counter()
+    try:
+        estimator.fit(X_train, y_train)
+    except Exception as e:
+        if error_score == "raise":
+            raise
+        result = {f"{subset}_{name}": error_score
+                  for name in scorers for subset in ("test", "train")}
+        result["score_time"] = 0.0
+        result["fit_time"] = time.perf_counter() - start
+        result["fit_error"] = f"{type(e).__name__}: {e}"
+        return result
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = {f"test_{name}": scorer(estimator, X_test, y_test)
+              for name, scorer in scorers.items()}
+    result["score_time"] = time.perf_counter() - start
+    result.update({f"train_{name}": scorer(estimator, X_train, y_train)
+                   for name, scorer in scorers.items()})
+    result["fit_time"] = fit_time
+    if return_estimator:
+        result["estimator"] = estimator
+    return result
+
+
+def _fit_rowwise(prefix, params, X):
+    """Fit the row-wise preprocessing steps with params and transform all of X."""
+    prefix = clone(prefix).set_params(**params)
+    return prefix, prefix.fit_transform(X)
+
+
+def _test_fold(estimator, params, X, y, train, test, scorers, prefix=None,
+               best_params=None, search_time=0.0, store=None, key=None):
+    """Fit, score and predict the model of one outer fold.
+
+    X is the output of the fitted row-wise preprocessing prefix (if any),
+    which is put back in front of the fitted model afterwards. If a store is
+    given, the result is saved there as soon as it is complete.
+
+    Returns:
+        dict: The result of _fit_and_score with the fitted estimator, plus the
+            train and test indices, the best parameters and the predictions,
+            confidence scores and probabilities for the test spectra.
+    """
+    result = _fit_and_score(estimator, params, X, y, train, test, scorers,
+                            return_estimator=True)
+    # As with cross_validate on a GridSearchCV, the fit time of a fold
+    # includes its grid search
+    result["fit_time"] += search_time
+
+    estimator = result["estimator"]
+    X_test = X[test]
+    result["y_pred"] = estimator.predict(X_test)
+    if hasattr(estimator, "decision_function"):
+        result["conf_scores"] = estimator.decision_function(X_test)
+    if hasattr(estimator, "predict_proba"):
+        result["probability"] = estimator.predict_proba(X_test)[:, 1]
+
+    if prefix is not None:
+        result["estimator"] = Pipeline(prefix.steps + estimator.steps)
+    result["train"], result["test"] = train, test
+    result["best_params"] = {} if best_params is None else best_params
+
+    if store is not None:
+        store.save(key, result)
+    return result
+
+
+class CheckpointStore:
+    """Directory with the finished parts of a CrossValidator run.
+
+    Every outer fold j of repetition i (key (i, j)) and every repetition as a
+    whole (key (i, None): the grid search on all data and the McNemar
+    p-value) is one file, written atomically as soon as it is complete. A
+    run with the same estimator, settings and data skips the parts that are
+    already in the store, so an interrupted run can be resumed, and stores
+    of runs on different machines can be combined with merge.
+
+    Args:
+        path (str or Path): Directory of the store, created if it does not exist.
+    """
+
+    _pattern = re.compile(r"trial(\d+)(?:_fold(\d+))?\.joblib$")
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        i, j = key
+        name = f"trial{i}.joblib" if j is None else f"trial{i}_fold{j}.joblib"
+        return os.path.join(self.path, name)
+
+    def keys(self):
+        """Keys of all stored results."""
+        keys = []
+        for name in sorted(os.listdir(self.path)):
+            match = self._pattern.match(name)
+            if match:
+                i, j = match.groups()
+                keys.append((int(i), None if j is None else int(j)))
+        return keys
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def load(self, key):
+        return load(self._file(key))
+
+    def save(self, key, result):
+        file = self._file(key)
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        dump(result, tmp_file)
+        os.replace(tmp_file, file)
+
+    @property
+    def fingerprint(self):
+        """Hash of the estimator, settings and data of the stored run, or None if it is empty."""
+        try:
+            with open(os.path.join(self.path, "fingerprint")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def check(self, fingerprint):
+        """Make sure the store belongs to a run with the given fingerprint.
+
+        Raises:
+            ValueError: If the store holds results of a different run.
+        """
+        stored = self.fingerprint
+        if stored is None:
+            with open(os.path.join(self.path, "fingerprint"), "w") as f:
+                f.write(fingerprint)
+        elif stored != fingerprint:
+            raise ValueError(f"Checkpoint {self.path} belongs to a run with "
+                             "a different estimator, settings or data.")
+
+    def merge(self, other):
+        """Copy the results of another store of the same run that are missing here.
+
+        Args:
+            other (CheckpointStore or str): Store, or its directory.
+
+        Returns:
+            int: Number of results copied.
+        """
+        if not isinstance(other, CheckpointStore):
+            other = CheckpointStore(other)
+        if other.fingerprint is not None:
+            self.check(other.fingerprint)
+
+        n_copied = 0
+        for key in other.keys():
+            if key not in self:
+                self.save(key, other.load(key))
+                n_copied += 1
+        return n_copied
+
+
 class CrossValidator(BaseEstimator, MetaEstimatorMixin):
+    """Repeated nested cross-validation with hyperparameter search.
+
+    Args:
+        estimator (estimator): Model (or Pipeline) to evaluate.
+        param_grid (dict or list of dicts, optional): Hyperparameters to search. If None, the estimator is evaluated as is. Defaults to None.
+        scoring (str or list, optional): Metric(s) for the search and the evaluation. Defaults to "accuracy".
+        refit (bool, str or callable, optional): Metric used to choose the best parameters if there are several, as in GridSearchCV. Defaults to True.
+        coef_func (callable, optional): Extracts the coefficients from a fitted estimator. Defaults to None.
+        explainer (bool, optional): Whether to compute SHAP explanations. Defaults to False.
+        n_folds (int, optional): Number of outer and inner folds. Defaults to 5.
+        n_trials (int, optional): Number of repetitions with different splits. Defaults to 20.
+        n_jobs (int, optional): Number of worker processes shared by all model fits. Defaults to 1.
+        verbose (int, optional): Verbosity of the worker pool. Defaults to 0.
+        feature_names (list, optional): Names of the features, for coefficients and SHAP values. Defaults to None.
+        cache_preprocessing (bool, optional): Whether to compute leading row-wise preprocessing steps of a Pipeline once instead of in every fit. Defaults to True.
+        memory (str or joblib.Memory, optional): Cache for the remaining Pipeline steps, see sklearn.pipeline.Pipeline. Defaults to None.
+        search (str, optional): "grid" for an exhaustive search, "halving" for successive halving. Defaults to "grid".
+        factor (int, optional): Successive halving keeps the best 1 / factor of the candidates in each round and multiplies their resources by factor. Defaults to 3.
+        resource (str, optional): Resource of successive halving: "n_samples" (training spectra) or the name of an integer parameter such as the number of iterations. Defaults to "n_samples".
+        min_resources (int, optional): Resources in the first round of successive halving. If None, chosen such that the last round uses all resources. Defaults to None.
+        max_resources (int, optional): Maximum resources, required if the resource is a parameter. Defaults to None (all training spectra).
+        checkpoint (str or CheckpointStore, optional): Store for the results of every outer fold and repetition as they complete. Results already in the store are not computed again. Defaults to None.
+    """
+
     def __init__(
         self,
         estimator,
@@ -177,7 +395,15 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
         n_trials=20,
         n_jobs=1,
         verbose=0,
-        feature_names=None
+        feature_names=None,
+        cache_preprocessing=True,
+        memory=None,
+        search="grid",
+        factor=3,
+        resource="n_samples",
+        min_resources=None,
+        max_resources=None,
+        checkpoint=None
     ):
         cv_logger.debug("Creating instance of CrossValidator")
         self.estimator = estimator
@@ -191,6 +417,14 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
         self.n_jobs = n_jobs
         self.verbose = verbose
         self.feature_names = feature_names
+        self.cache_preprocessing = cache_preprocessing
+        self.memory = memory
+        self.search = search
+        self.factor = factor
+        self.resource = resource
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+        self.checkpoint = checkpoint
 
     def fit(self, X, y=None):
         if self.explainer:
@@ -205,41 +439,15 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
 
         cv_logger.debug("Setting up result arrays")
         self._prep_results(X, y)
+        units = self._run_trials(X, y, range(self.n_trials))
 
-        cv_logger.debug("Starting CV repetitions")
-        for i in tqdm(range(self.n_trials)):
-            cv_logger.debug(f"Repetition {i}")
-
-            cv_logger.debug("Getting CV splits")
-            outer_cv, inner_cv = self._get_cv(random_state=i)
-
-            dummy_results = self._get_dummy_results(X, y, outer_cv)
-
+        for i in range(self.n_trials):
+            cv_logger.debug(f"Storing results of repetition {i}")
             if self.do_gs:
-                cv_logger.debug("Starting grid search")
-                estimator = self._do_gridsearch(X, y, inner_cv)
-                cv_logger.debug("Grid search complete. Storing results...")
-                self._store_cv_results(estimator, i)
-                ct_jobs = 1
-
-            else:
-                estimator = self.estimator
-                ct_jobs = self.n_jobs
-
-            cv_logger.debug("Starting cross testing")
-            ct_results_tmp = cross_validate(estimator,
-                                            X, y,
-                                            scoring=self.scoring,
-                                            cv=outer_cv,
-                                            return_estimator=True,
-                                            return_train_score=True,
-                                            n_jobs=ct_jobs,
-                                            verbose=self.verbose)
-            cv_logger.debug("Cross testing complete. Storing results...")
+                self._store_cv_results(units[i, None]["search"], i)
             self._store_ct_results(X, y, i,
-                                   outer_cv,
-                                   dummy_results,
-                                   ct_results_tmp)
+                                   [units[i, j] for j in range(self.n_folds)],
+                                   units[i, None]["p_value"])
 
         if self.explainer:
             cv_logger.debug("Storing SHAP results")
@@ -250,6 +458,28 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
 
         return self
 
+    def run_trials(self, X, y, trials):
+        """Compute the results of some repetitions and save them to the checkpoint.
+
+        Used to split a run across machines: each one runs some of the
+        repetitions into its own store, and after merging the stores, fit
+        only collects the results.
+
+        Args:
+            X (numpy.ndarray): Spectra, one per row.
+            y (numpy.ndarray): Targets.
+            trials (iterable of int): Repetitions to compute.
+
+        Returns:
+            CrossValidator: self.
+        """
+        if self.checkpoint is None:
+            raise ValueError("run_trials requires a checkpoint.")
+        self.do_gs = bool(self.param_grid)
+        self.multi_score = not isinstance(self.scoring, str)
+        self._run_trials(X, y, trials)
+        return self
+
     def predict(self, X):
         """Pass-through from underlying estimator"""
         return self.estimator_.predict(X)
@@ -270,6 +500,100 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
         """Pass-through from underlying estimator"""
         return self.estimator_.score(X, y)
 
+    def _checkpoint_store(self, X, y):
+        """The checkpoint store, checked to belong to this run, or None."""
+        if self.checkpoint is None:
+            return None
+        store = self.checkpoint
+        if not isinstance(store, CheckpointStore):
+            store = CheckpointStore(store)
+
+        settings = {name: getattr(self, name)
+                    for name in ("estimator", "param_grid", "scoring", "refit",
+                                 "n_folds", "search", "factor", "resource",
+                                 "min_resources", "max_resources")}
+        if callable(self.refit):
+            settings["refit"] = getattr(self.refit, "__qualname__", repr(self.refit))
+        store.check(joblib_hash((settings, np.asarray(X), np.asarray(y))))
+        return store
+
+    def _run_trials(self, X, y, trials):
+        """Results of the outer folds and repetitions in trials.
+
+        Results found in the checkpoint store are loaded, all others are
+        computed, with all model fits run by a single pool of n_jobs workers
+        so nested parallelism cannot oversubscribe the cores.
+
+        Returns:
+            dict: For each (repetition, outer fold), the result of _test_fold,
+                and for each (repetition, None), the grid search on all data
+                and the McNemar p-value of the repetition.
+        """
+        store = self._checkpoint_store(X, y)
+        keys = [(i, j) for i in trials for j in [*range(self.n_folds), None]]
+        units = {}
+        if store is not None:
+            units = {key: store.load(key) for key in keys if key in store}
+            cv_logger.info(f"Loaded {len(units)} of {len(keys)} results from checkpoint")
+        missing = [key for key in keys if key not in units]
+        if not missing:
+            return units
+
+        scorers = _get_scorers(self.estimator, self.scoring)
+        cv_logger.debug("Getting CV splits")
+        # Splits of all repetitions, so successive halving plans its rounds
+        # the same way no matter which repetitions are computed
+        splits = [self._get_splits(X, y, random_state=i)
+                  for i in range(self.n_trials)]
+        combinations = list(ParameterGrid(self.param_grid)) if self.do_gs else [{}]
+        fold_keys = [key for key in missing if key[1] is not None]
+
+        with Parallel(n_jobs=self.n_jobs, verbose=self.verbose) as parallel:
+            cv_logger.debug("Preprocessing")
+            prepared = self._prepare(parallel, X, combinations)
+
+            searches = {}
+            best_index = defaultdict(int)
+            if self.do_gs:
+                cv_logger.debug("Starting grid searches")
+                searches = self._run_gridsearches(parallel, y, splits, scorers,
+                                                  combinations, prepared, missing)
+                best_index = {key: search["best_index"]
+                              for key, search in searches.items()}
+
+            cv_logger.debug("Starting cross testing")
+            results = parallel(
+                delayed(_test_fold)(prepared[best_index[i, j]][0],
+                                    self._final_params(prepared[best_index[i, j]]),
+                                    prepared[best_index[i, j]][2], y,
+                                    *splits[i]["outer"][j], scorers,
+                                    prefix=prepared[best_index[i, j]][3],
+                                    best_params=combinations[best_index[i, j]],
+                                    search_time=searches[i, j]["time"] if self.do_gs else 0.0,
+                                    store=store, key=(i, j))
+                for i, j in fold_keys)
+        units.update(zip(fold_keys, results))
+
+        new_trials = [i for i, j in missing if j is None]
+        if new_trials:
+            cv_logger.debug("Performing McNemar tests")
+            y_pred = np.zeros((len(new_trials), len(y)))
+            rows = np.repeat(np.arange(len(new_trials)), len(y))
+            y_pred[rows, np.concatenate([units[i, j]["test"] for i in new_trials
+                                         for j in range(self.n_folds)])] = \
+                np.concatenate([units[i, j]["y_pred"] for i in new_trials
+                                for j in range(self.n_folds)])
+            dummy_results = np.array([
+                self._get_dummy_results(X, y, self._get_cv(random_state=i)[0])
+                for i in new_trials])
+            _, p_values = mcnemar_tests(mcnemar_tables(y, dummy_results, y_pred))
+
+            for i, p_val in zip(new_trials, p_values):
+                units[i, None] = {"search": searches.get((i, None)), "p_value": p_val}
+                if store is not None:
+                    store.save((i, None), units[i, None])
+        return units
+
     def _prep_results(self, X, y):
         if self.do_gs:
             cv_logger.debug("Creating arrays for grid search results")
@@ -321,38 +645,267 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
         return dummy_results
 
 
-    def _do_gridsearch(self, X, y, cv):
-
-        gridsearch = GridSearchCV(self.estimator,
-                                  param_grid=self.param_grid,
-                                  scoring=self.scoring,
-                                  refit=self.refit,
-                                  return_train_score=True,
-                                  cv=cv,
-                                  verbose=self.verbose,
-                                  n_jobs=self.n_jobs)
-
-        gridsearch.fit(X, y)
-
-        return gridsearch
-
-    def _store_cv_results(self, gridsearch, i):
+    def _get_splits(self, X, y, random_state=None):
+        """Outer folds and inner grid search folds of one repetition.
+
+        The inner folds are given as indices into X, for the grid search on
+        all data (key None) and within the training set of each outer fold.
+        """
+        outer_cv, inner_cv = self._get_cv(random_state=random_state)
+        outer = list(outer_cv.split(X, y))
+        inner = {None: list(inner_cv.split(X, y))}
+        for j, (train, _) in enumerate(outer):
+            inner[j] = [(train[inner_train], train[inner_test])
+                        for inner_train, inner_test
+                        in inner_cv.split(X[train], y[train])]
+        return {"outer": outer, "inner": inner}
+
+    def _split_preprocessing(self):
+        """Split the estimator into leading row-wise preprocessing and the rest.
+
+        Row-wise steps (e.g. BaselineCorrector, SavGolFilter, RangeLimiter)
+        transform every spectrum on its own and learn nothing from the
+        training data, so their output on the training rows of a fold is the
+        same as the corresponding rows of their output on all data.
+
+        Returns:
+            prefix (Pipeline): The leading row-wise steps, or None if there are none.
+            rest (estimator): The remaining steps, with the memory cache set if it is a Pipeline.
+        """
+        estimator = self.estimator
+        if not isinstance(estimator, Pipeline):
+            return None, estimator
+
+        n_rowwise = 0
+        if self.cache_preprocessing:
+            for _, step in estimator.steps[:-1]:
+                if not is_rowwise(step):
+                    break
+                n_rowwise += 1
+
+        if n_rowwise == 0 and self.memory is None:
+            return None, estimator
+
+        memory = estimator.memory if self.memory is None else self.memory
+        rest = Pipeline(estimator.steps[n_rowwise:], memory=memory)
+        if n_rowwise == 0:
+            return None, rest
+        return Pipeline(estimator.steps[:n_rowwise]), rest
+
+    def _prepare(self, parallel, X, combinations):
+        """Precompute the row-wise preprocessing once per distinct setting of its parameters.
+
+        Returns:
+            list: For each parameter combination, the estimator and parameters
+                to fit, the data to fit them on, and the fitted row-wise
+                preprocessing (or None).
+        """
+        prefix, rest = self._split_preprocessing()
+        if prefix is None:
+            return [(rest, params, X, None) for params in combinations]
+
+        prefix_steps = {name for name, _ in prefix.steps}
+        split_params = []
+        for params in combinations:
+            prefix_params = {key: val for key, val in params.items()
+                             if key.split("__")[0] in prefix_steps}
+            rest_params = {key: val for key, val in params.items()
+                           if key not in prefix_params}
+            split_params.append((prefix_params, rest_params))
+
+        settings = {}
+        for prefix_params, _ in split_params:
+            settings.setdefault(repr(sorted(prefix_params.items())), prefix_params)
+        transformed = dict(zip(settings, parallel(
+            delayed(_fit_rowwise)(prefix, prefix_params, X)
+            for prefix_params in settings.values())))
+
+        prepared = []
+        for prefix_params, rest_params in split_params:
+            fitted_prefix, X_pre = transformed[repr(sorted(prefix_params.items()))]
+            prepared.append((rest, rest_params, X_pre, fitted_prefix))
+        return prepared
+
+    def _run_gridsearches(self, parallel, y, splits, scorers, combinations, prepared,
+                          keys=None):
+        """Run the hyperparameter searches of the given (or all) repetitions and outer folds.
+
+        All searches advance together, so each round (a single one for an
+        exhaustive grid search, one per halving step for successive halving)
+        is one batch of jobs for the worker pool.
+
+        Returns:
+            dict: For each (repetition, outer fold or None), the parameter
+                combinations with their mean train and test scores (from the
+                last round a combination took part in), the index of the best
+                combination and the total time spent.
+        """
+        if keys is None:
+            keys = [(i, j) for i in range(self.n_trials) for j in splits[i]["inner"]]
+        searches = {key: {"params": combinations, "time": 0.0} for key in keys}
+        for search in searches.values():
+            for name in scorers:
+                for subset in ("train", "test"):
+                    search[f"mean_{subset}_{name}"] = np.full(len(combinations), np.nan)
+
+        candidates = {key: np.arange(len(combinations)) for key in keys}
+        schedules = self._resource_schedules(y, splits, len(combinations))
+        n_rounds = len(next(iter(schedules.values())))
+
+        for round_ in range(n_rounds):
+            jobs = [(i, j, c, k)
+                    for i, j in keys
+                    for c in candidates[i, j]
+                    for k in range(len(splits[i]["inner"][j]))]
+            results = parallel(
+                delayed(_fit_and_score)(
+                    *self._round_job(prepared[c], y, splits[i]["inner"][j][k],
+                                     schedules[i, j][round_], i),
+                    scorers, error_score=np.nan)
+                for i, j, c, k in jobs)
+            self._warn_failed_fits(jobs, results, combinations)
+
+            grouped = defaultdict(list)
+            for (i, j, _, _), result in zip(jobs, results):
+                grouped[i, j].append(result)
+
+            for key, key_results in grouped.items():
+                search = searches[key]
+                search["time"] += sum(r["fit_time"] + r["score_time"] for r in key_results)
+                for name in scorers:
+                    for subset in ("train", "test"):
+                        scores = np.array([r[f"{subset}_{name}"] for r in key_results])
+                        search[f"mean_{subset}_{name}"][candidates[key]] = \
+                            scores.reshape(len(candidates[key]), -1).mean(axis=1)
+
+                if round_ < n_rounds - 1:
+                    n_keep = int(np.ceil(len(candidates[key]) / self.factor))
+                    means = search[f"mean_test_{self._refit_metric()}"][candidates[key]]
+                    # Stable, so ties keep the earlier combination
+                    order = np.argsort(-np.where(np.isnan(means), -np.inf, means),
+                                       kind="stable")
+                    candidates[key] = np.sort(candidates[key][order[:n_keep]])
+
+        for key, search in searches.items():
+            search["candidates"] = candidates[key]
+            search["best_index"] = self._best_index(search)
+        return searches
+
+    @staticmethod
+    def _warn_failed_fits(jobs, results, combinations):
+        """Warn about failed grid search fits, which are scored as NaN and rank last."""
+        failed = [(c, r["fit_error"]) for (_, _, c, _), r in zip(jobs, results)
+                  if "fit_error" in r]
+        if not failed:
+            return
+        errors = defaultdict(int)
+        for _, error in failed:
+            errors[error] += 1
+        details = "\n".join(f"{n} fits failed with {error}" for error, n in errors.items())
+        warnings.warn(f"{len(failed)} of {len(results)} grid search fits failed and are "
+                      f"scored as NaN, e.g. with parameters {combinations[failed[0][0]]}.\n"
+                      f"{details}", FitFailedWarning)
+
+    def _resource_schedules(self, y, splits, n_candidates):
+        """Resources (training spectra or value of the resource parameter) per round of each search.
+
+        An exhaustive grid search has a single round with all resources. For
+        successive halving, the number of rounds is chosen such that the
+        last round evaluates between 1 and factor candidates, and the
+        resources grow by factor in each round up to the maximum.
+        """
+        keys = [(i, j) for i in range(self.n_trials) for j in splits[i]["inner"]]
+        if self.search == "grid":
+            return {key: [None] for key in keys}
+        if self.search != "halving":
+            raise ValueError(f"Unknown search {self.search}.")
+
+        if self.resource == "n_samples":
+            max_resources = {key: min(len(train) for train, _ in splits[key[0]]["inner"][key[1]])
+                             for key in keys}
+            if self.max_resources is not None:
+                max_resources = {key: min(r, self.max_resources)
+                                 for key, r in max_resources.items()}
+        elif self.max_resources is None:
+            raise ValueError("max_resources is required if the resource is a parameter.")
+        else:
+            max_resources = {key: self.max_resources for key in keys}
+
+        n_rounds = 1 + int(np.floor(np.log(n_candidates) / np.log(self.factor)))
+        if self.min_resources is None:
+            smallest = 1
+            if self.resource == "n_samples":
+                n_classes = len(np.unique(y)) if is_classifier(self.estimator) else 1
+                smallest = 2 * self.n_folds * n_classes
+            min_resources = {key: max(smallest, r // self.factor**(n_rounds - 1))
+                             for key, r in max_resources.items()}
+        else:
+            min_resources = {key: self.min_resources for key in keys}
+
+        # Fewer rounds if the resources cannot grow by factor often enough
+        n_possible = 1 + int(np.floor(np.log(
+            min(max_resources[key] / min_resources[key] for key in keys))
+            / np.log(self.factor)))
+        n_rounds = max(1, min(n_rounds, n_possible))
+        return {key: [min(max_resources[key], min_resources[key] * self.factor**k)
+                      for k in range(n_rounds)]
+                for key in keys}
+
+    def _round_job(self, prepared, y, split, n_resources, random_state):
+        """Arguments of _fit_and_score for one candidate and inner fold in a round."""
+        estimator, params, X_fit, _ = prepared
+        train, test = split
+        if n_resources is not None:
+            if self.resource == "n_samples":
+                if n_resources < len(train):
+                    stratify = y[train] if is_classifier(self.estimator) else None
+                    train = np.sort(resample(train, replace=False, n_samples=n_resources,
+                                             random_state=random_state, stratify=stratify))
+            else:
+                params = {**params, self.resource: n_resources}
+        return estimator, params, X_fit, y, train, test
+
+    def _final_params(self, prepared):
+        """Parameters of a combination for fitting it with all resources."""
+        params = prepared[1]
+        if self.search == "halving" and self.resource != "n_samples":
+            params = {**params, self.resource: self.max_resources}
+        return params
+
+    def _best_index(self, search):
+        """Index of the best parameter combination, chosen as GridSearchCV would."""
+        if callable(self.refit):
+            return self.refit(search)
+        means = search[f"mean_test_{self._refit_metric()}"]
+        # Failed fits (NaN) and candidates eliminated by successive halving
+        # rank last, ties go to the first combination
+        eligible = np.zeros(len(means), dtype=bool)
+        eligible[search.get("candidates", slice(None))] = True
+        return int(np.argmax(np.where(eligible & ~np.isnan(means), means, -np.inf)))
+
+    def _refit_metric(self):
+        return self.refit if self.multi_score and not callable(self.refit) else "score"
+
+    def _store_cv_results(self, search, i):
         if self.multi_score:
             for score in self.scoring:
-                self.cv_results_[f"train_{score}_{i}"] = gridsearch.cv_results_[
-                    f"mean_train_{score}"]
-                self.cv_results_[f"test_{score}_{i}"] = gridsearch.cv_results_[
-                    f"mean_test_{score}"]
+                self.cv_results_[f"train_{score}_{i}"] = search[f"mean_train_{score}"]
+                self.cv_results_[f"test_{score}_{i}"] = search[f"mean_test_{score}"]
         else:
-            self.cv_results_[f"train_score_{i}"] = gridsearch.cv_results_[
-                f"mean_train_score"]
-            self.cv_results_[f"test_score_{i}"] = gridsearch.cv_results_[
-                f"mean_test_score"]
-        for name, val in gridsearch.best_params_.items():
+            self.cv_results_[f"train_score_{i}"] = search["mean_train_score"]
+            self.cv_results_[f"test_score_{i}"] = search["mean_test_score"]
+        for name, val in search["params"][search["best_index"]].items():
             self.param_results_[name].append(val)
 
 
-    def _store_ct_results(self, X, y, i, outer_cv, dummy_results, ct_results_tmp):
+    def _store_ct_results(self, X, y, i, fold_results, p_value):
+        ct_results_tmp = {key: np.array([r[key] for r in fold_results])
+                          for key in ("fit_time", "score_time")}
+        for name in _get_scorers(self.estimator, self.scoring):
+            for subset in ("train", "test"):
+                key = f"{subset}_{name}"
+                ct_results_tmp[key] = np.array([r[key] for r in fold_results])
+
         if self.multi_score:
             for score in self.scoring:
                 self.ct_results_[f"train_{score}"].append(ct_results_tmp[f"train_{score}"].mean())
@@ -372,30 +925,25 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
             shap_base_vals = np.zeros(len(y))
             shap_data = np.zeros((len(y), X.shape[1]))
 
-        for j, (train, test) in enumerate(outer_cv.split(X, y)):
+        for j, result in enumerate(fold_results):
             cv_logger.debug(f"Storing CT results of fold {j}")
+            train, test = result["train"], result["test"]
             X_train, X_test = X[train], X[test]
 
-            current_estimator = ct_results_tmp["estimator"][j]
-
-            if self.do_gs:
-                current_estimator = current_estimator.best_estimator_
+            current_estimator = result["estimator"]
 
             if self.coef_func:
                 cv_logger.debug("Storing coefficients")
                 coef_tmp[j,:] = self.coef_func(current_estimator).squeeze()
 
             cv_logger.debug("Storing predictions")
-            y_pred = current_estimator.predict(X_test)
-            self.predictions_["y_pred"][i, test] = y_pred
+            self.predictions_["y_pred"][i, test] = result["y_pred"]
 
-            if hasattr(current_estimator, "decision_function"):
-                conf_scores = current_estimator.decision_function(X_test)
-                self.predictions_["conf_scores"][i, test] = conf_scores
+            if "conf_scores" in result:
+                self.predictions_["conf_scores"][i, test] = result["conf_scores"]
 
-            if hasattr(current_estimator, "predict_proba"):
-                proba = current_estimator.predict_proba(X_test)[:,1]
-                self.predictions_["probability"][i, test] = proba
+            if "probability" in result:
+                self.predictions_["probability"][i, test] = result["probability"]
 
             if self.explainer:
                 cv_logger.debug("Creating SHAP explanation")
@@ -412,12 +960,7 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
                 shap_base_vals[test] = shap_tmp.base_values
                 shap_data[test, :] = shap_tmp.data
 
-        cv_logger.debug("Performing McNemar test")
-        mcn_table = mcnemar_table(y.ravel(),
-                                  dummy_results.ravel(),
-                                  self.predictions_["y_pred"][i].ravel())
-        _, p_val = mcnemar(mcn_table)
-        self.ct_results_["p_value"].append(p_val)
+        self.ct_results_["p_value"].append(p_value)
 
         cv_logger.debug("Averaging results")
         if self.coef_func:
@@ -445,6 +988,9 @@ class CrossValidator(BaseEstimator, MetaEstimatorMixin):
 
                 params_final_model[param] = val_final
 
+            if self.search == "halving" and self.resource != "n_samples":
+                params_final_model[self.resource] = self.max_resources
+
             cv_logger.debug("Setting parameters for final model")
             self.estimator_.set_params(**params_final_model)
 
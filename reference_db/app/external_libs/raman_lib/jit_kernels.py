@@ -0,0 +1,198 @@
+import numpy as np
+from numba import njit, prange
+
+_MIN_FLOAT = np.finfo(np.float64).eps
+
+
+@njit(cache=True)
+def _solve_banded_cholesky(ab, rhs):
+    """Solve A x = rhs for symmetric positive definite banded A.
+
+    ab holds A in lower banded form, i.e. ab[u, j] = A[j + u, j].
+    """
+    bw = ab.shape[0] - 1
+    n = ab.shape[1]
+    L = np.empty_like(ab)
+
+    for j in range(n):
+        s = ab[0, j]
+        for k in range(1, min(bw, j) + 1):
+            s -= L[k, j - k] ** 2
+        d = np.sqrt(s)
+        L[0, j] = d
+        for u in range(1, min(bw, n - 1 - j) + 1):
+            s = ab[u, j]
+            for k in range(1, min(bw - u, j) + 1):
+                s -= L[u + k, j - k] * L[k, j - k]
+            L[u, j] = s / d
+
+    z = np.empty(n)
+    for j in range(n):
+        s = rhs[j]
+        for k in range(1, min(bw, j) + 1):
+            s -= L[k, j - k] * z[j - k]
+        z[j] = s / L[0, j]
+
+    x = np.empty(n)
+    for j in range(n - 1, -1, -1):
+        s = z[j]
+        for k in range(1, min(bw, n - 1 - j) + 1):
+            s -= L[k, j] * x[j + k]
+        x[j] = s / L[0, j]
+
+    return x
+
+
+@njit(cache=True)
+def _relative_difference(old, new):
+    num = 0.0
+    den = 0.0
+    for j in range(old.shape[0]):
+        num += (new[j] - old[j]) ** 2
+        den += old[j] ** 2
+    return np.sqrt(num) / max(np.sqrt(den), _MIN_FLOAT)
+
+
+@njit(cache=True)
+def _whittaker_row(y, penalty, method, p, max_iter, tol):
+    n = y.shape[0]
+    weights = np.ones(n)
+    new_weights = np.empty(n)
+    ab = np.empty_like(penalty)
+    baseline = np.empty(n)
+
+    for _ in range(max_iter + 1):
+        ab[:] = penalty
+        ab[0] += weights
+        baseline = _solve_banded_cholesky(ab, weights * y)
+
+        if method == 0:  # asls
+            for j in range(n):
+                new_weights[j] = p if y[j] > baseline[j] else 1 - p
+        else:  # arpls
+            n_neg = 0
+            total = 0.0
+            for j in range(n):
+                r = y[j] - baseline[j]
+                if r < 0:
+                    n_neg += 1
+                    total += r
+            if n_neg < 2:
+                break
+            mean = total / n_neg
+            var = 0.0
+            for j in range(n):
+                r = y[j] - baseline[j]
+                if r < 0:
+                    var += (r - mean) ** 2
+            std = np.sqrt(var / (n_neg - 1))
+            if std == 0:
+                std = _MIN_FLOAT
+            for j in range(n):
+                r = y[j] - baseline[j]
+                new_weights[j] = 1 / (1 + np.exp((2 / std) * (r - (2 * std - mean))))
+
+        if _relative_difference(weights, new_weights) < tol:
+            break
+        weights[:] = new_weights
+
+    return baseline
+
+
+@njit(parallel=True, cache=True)
+def whittaker_rows(X, penalty, method, p, max_iter, tol):
+    """Reweighted Whittaker baselines of all rows of X, in parallel over rows.
+
+    method is 0 for asls and 1 for arpls.
+    """
+    bl = np.empty_like(X)
+    for i in prange(X.shape[0]):
+        bl[i] = _whittaker_row(X[i], penalty, method, p, max_iter, tol)
+    return bl
+
+
+@njit(cache=True)
+def _sign(x):
+    if x > 0:
+        return 1.0
+    if x < 0:
+        return -1.0
+    if x == 0:
+        return 0.0
+    return np.nan
+
+
+@njit(cache=True)
+def _mark_peaks(d, y, threshold, min_height, marks):
+    """Flag the peaks of one spectrum in marks (length len(d) - 1).
+
+    Same rules as spectra_scoring.find_peak_positions.
+    """
+    n = d.shape[0]
+    # Last crossing at or before j, and first crossing at or after j
+    prev_crossing = np.empty(n - 1, dtype=np.int64)
+    next_crossing = np.empty(n - 1, dtype=np.int64)
+
+    last = -1
+    for j in range(n - 1):
+        if _sign(d[j + 1]) != _sign(d[j]):
+            last = j
+        prev_crossing[j] = last
+    first = n
+    for j in range(n - 2, -1, -1):
+        if prev_crossing[j] == j:
+            first = j
+        next_crossing[j] = first
+
+    for j in range(1, n - 1):
+        if d[j] > d[j - 1] and d[j] > d[j + 1]:
+            if d[j] > threshold and j < last:
+                marks[next_crossing[j]] = True
+        elif d[j] < d[j - 1] and d[j] < d[j + 1]:
+            if d[j] < -threshold and j > first:
+                marks[prev_crossing[j - 1]] = True
+
+    for j in range(n - 1):
+        if marks[j] and not y[j] >= min_height:
+            marks[j] = False
+
+
+@njit(parallel=True, cache=True)
+def peak_positions(deriv, data_bl, threshold, min_height):
+    """Compiled equivalent of spectra_scoring.find_peak_positions."""
+    n_spectra, n_points = deriv.shape
+    marks = np.zeros((n_spectra, max(n_points - 1, 0)), dtype=np.bool_)
+    counts = np.zeros(n_spectra, dtype=np.int64)
+    for i in prange(n_spectra):
+        if n_points > 1:
+            _mark_peaks(deriv[i], data_bl[i], threshold, min_height, marks[i])
+        counts[i] = marks[i].sum()
+
+    indptr = np.zeros(n_spectra + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(counts)
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    for i in prange(n_spectra):
+        k = indptr[i]
+        for j in range(n_points - 1):
+            if marks[i, j]:
+                indices[k] = j
+                k += 1
+    return indptr, indices
+
+
+@njit(parallel=True, cache=True)
+def peak_height_medians(values, indptr, indices):
+    """Median height of the peaks of each spectrum, 0 for spectra without peaks."""
+    n_spectra = indptr.shape[0] - 1
+    medians = np.zeros(n_spectra)
+    for i in prange(n_spectra):
+        start, stop = indptr[i], indptr[i + 1]
+        count = stop - start
+        if count == 0:
+            continue
+        heights = np.empty(count)
+        for k in range(count):
+            heights[k] = values[i, indices[start + k]]
+        heights.sort()
+        medians[i] = (heights[(count - 1) // 2] + heights[count // 2]) / 2
+    return medians
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class RaggedPeaks:
+    """Peak positions of a set of spectra in compressed sparse row layout.
+
+    The peaks of spectrum i are indices[indptr[i]:indptr[i + 1]]. Indexing
+    with an integer returns the (read-only) positions of one spectrum, so a
+    RaggedPeaks can be used like the list of arrays it replaces; indexing
+    with a slice, a boolean mask or an array of positions returns the peaks
+    of those spectra as a new RaggedPeaks.
+
+    Args:
+        indptr (array-like): Offsets of the peaks of each spectrum, length n_spectra + 1.
+        indices (array-like): Peak positions of all spectra, concatenated.
+        heights (array-like, optional): Intensity at each peak, aligned with indices. Defaults to None.
+    """
+
+    def __init__(self, indptr, indices, heights=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.heights = None if heights is None else np.asarray(heights, dtype=float)
+        if len(self.indptr) == 0 or self.indptr[-1] != len(self.indices):
+            raise ValueError("indptr does not match the number of indices.")
+        if self.heights is not None and len(self.heights) != len(self.indices):
+            raise ValueError("heights must have one value per peak.")
+
+    @classmethod
+    def from_lists(cls, peaks):
+        """Create from a sequence with the array of peaks of each spectrum.
+
+        RaggedPeaks are returned unchanged.
+        """
+        if isinstance(peaks, cls):
+            return peaks
+        peaks = [np.asarray(p, dtype=np.int32).ravel() for p in peaks]
+        indptr = np.zeros(len(peaks) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in peaks], out=indptr[1:])
+        indices = np.concatenate(peaks) if peaks else np.zeros(0, dtype=np.int32)
+        return cls(indptr, indices)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Join the peaks of several sets of spectra, in order."""
+        parts = [cls.from_lists(p) for p in parts]
+        if not parts:
+            return cls(np.zeros(1), np.zeros(0))
+        offsets = np.cumsum([0] + [p.indptr[-1] for p in parts[:-1]])
+        indptr = np.concatenate([parts[0].indptr[:1]]
+                                + [p.indptr[1:] + offset for p, offset in zip(parts, offsets)])
+        heights = None
+        if all(p.heights is not None for p in parts):
+            heights = np.concatenate([p.heights for p in parts])
+        return cls(indptr, np.concatenate([p.indices for p in parts]), heights)
+
+    @property
+    def counts(self):
+        """Number of peaks of each spectrum."""
+        return np.diff(self.indptr)
+
+    @property
+    def rows(self):
+        """Index of the spectrum each peak belongs to, aligned with indices."""
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def with_heights(self, data):
+        """Copy with the heights taken from data (the spectra, one per row) at the peaks."""
+        values = np.asarray(data, dtype=float)
+        return type(self)(self.indptr, self.indices, values[self.rows, self.indices])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("spectrum index out of range")
+            peaks = self.indices[self.indptr[key]:self.indptr[key + 1]]
+            peaks.flags.writeable = False
+            return peaks
+
+        selected = np.arange(len(self))[key]
+        counts = self.counts[selected]
+        indptr = np.zeros(len(selected) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # Position of every selected peak in indices
+        take = (np.arange(indptr[-1])
+                - np.repeat(indptr[:-1] - self.indptr[selected], counts))
+        heights = None if self.heights is None else self.heights[take]
+        return type(self)(indptr, self.indices[take], heights)
+
+    def tolist(self):
+        """The peaks as a list with one array per spectrum."""
+        if len(self) == 0:
+            return []
+        return np.split(self.indices, self.indptr[1:-1])
+
+    def __repr__(self):
+        return f"RaggedPeaks(n_spectra={len(self)}, n_peaks={len(self.indices)})"
@@ -1,56 +1,211 @@
 import numpy as np
 import pandas as pd
-from pybaselines.misc import beads
-from pybaselines.morphological import mormol, rolling_ball
-from pybaselines.whittaker import arpls, asls
+from joblib import Parallel, delayed, effective_n_jobs
 from sklearn.base import BaseEstimator, TransformerMixin
-from scipy.signal import savgol_filter, find_peaks
+from sklearn.preprocessing import Normalizer
+from scipy.signal import find_peaks
+from scipy.sparse import csr_matrix
 
+from .baselines import (baseline_backends, fit_baselines, fit_single_threaded,
+                        select_backend)
+from .savgol import savgol_derivatives
 
-class BaselineCorrector(BaseEstimator, TransformerMixin):
-    def __init__(self, method="asls"):
+
+# Size of the row blocks that are processed at once when writing into an
+# existing buffer, which bounds the temporary memory per step.
+BLOCK_BYTES = 2**22
+
+# The batched baseline fits allocate about this many temporaries of the size
+# of their input block, so BaselineCorrector uses blocks that much smaller.
+_BASELINE_WORKSPACE = 8
+
+
+def _row_blocks(X, block_bytes=BLOCK_BYTES):
+    """Yield (start, stop) bounds of row blocks of about block_bytes each."""
+    n_rows, n_cols = np.shape(X)
+    step = max(1, block_bytes // max(1, 8 * n_cols))
+    for start in range(0, n_rows, step):
+        yield start, min(start + step, n_rows)
+
+
+def _fit_baselines_blockwise(func, X):
+    """Baselines of all rows of X, fitted block by block in a worker process."""
+    bl = np.empty(np.shape(X))
+    for start, stop in _row_blocks(X, BLOCK_BYTES // _BASELINE_WORKSPACE):
+        bl[start:stop] = fit_single_threaded(func, X[start:stop])
+    return bl
+
+
+def _output_buffer(X, copy, out):
+    """Return the array a transformer should write its result to.
+
+    None means that no suitable buffer exists and the result has to be
+    allocated. With copy=False, float arrays are overwritten in place.
+    """
+    if out is not None:
+        if out.shape != np.shape(X):
+            raise ValueError("out must have the same shape as X.")
+        return out
+    if not copy and isinstance(X, np.ndarray) and X.dtype.kind == "f" \
+            and X.flags.writeable:
+        return X
+    return None
+
+
+class StreamingMixin:
+    """Incremental fitting and chunk-wise transformation of spectra.
+
+    Transformers without state only need the default partial_fit.
+    """
+
+    def partial_fit(self, X, y=None):
+        return self
+
+    def transform_stream(self, chunks, fit=False):
+        """Transform chunks of spectra as they arrive.
+
+        Args:
+            chunks (iterable): Arrays with one spectrum per row, e.g. read from the instrument during a run.
+            fit (bool, optional): Whether to call partial_fit on each chunk before transforming it. Defaults to False.
+
+        Yields:
+            numpy.ndarray: The transformed chunk.
+        """
+        for chunk in chunks:
+            if fit:
+                self.partial_fit(chunk)
+            yield self.transform(chunk)
+
+
+class BaselineCorrector(StreamingMixin, BaseEstimator, TransformerMixin):
+    """Estimate and subtract the baseline of each spectrum.
+
+    engine selects the implementation (backend) of the method, see
+    baselines.baseline_backends. For "asls" and "arpls" the default "native"
+    engine fits all spectra in a batch with banded solvers, for the other
+    methods it falls back to "pybaselines", which fits row by row (or to
+    the first backend of a method added with register_backend). A
+    "numba" engine exists if numba is installed. With engine="auto", the
+    fastest backend for the shape of the data is benchmarked and used.
+    All backends agree within the convergence tolerance of the method.
+
+    If a BaselineCache is passed as cache, baselines of spectra that were
+    already corrected with the same settings are taken from it.
+
+    Spectra are corrected in row blocks, so the temporary memory of the fit
+    stays around BLOCK_BYTES. With copy=False, float arrays are corrected in
+    place. With n_jobs > 1, the spectra are split among the workers once and
+    each worker fits its share block by block.
+    """
+
+    def __init__(self, method="asls", n_jobs=None, engine="native", cache=None,
+                 copy=True):
         self.method = method
+        self.n_jobs = n_jobs
+        self.engine = engine
+        self.cache = cache
+        self.copy = copy
 
     def fit(self, X, y=None):
         return self
 
-    def transform(self, X, y=None):
-        X = X.copy()
-        if type(X) != np.ndarray:
-            X = np.asarray(X)
+    def transform(self, X, y=None, out=None):
+        """Subtract the baselines from X.
 
-        bl = np.zeros_like(X)
+        Args:
+            X (array-like): Spectra, one per row.
+            out (numpy.ndarray, optional): Array to write the corrected
+                spectra to. May be X itself. Defaults to None.
 
-        if self.method == "asls":
-            for i, row in enumerate(X):
-                bl[i] = asls(row)[0]
+        Returns:
+            numpy.ndarray: Baseline-corrected spectra.
+        """
+        X = np.asarray(X)
 
-        elif self.method == "arpls":
-            for i, row in enumerate(X):
-                bl[i] = arpls(row)[0]
+        if self.method not in baseline_backends:
+            raise ValueError(f"Method {self.method} does not exist.")
 
-        elif self.method == "mormol":
-            for i, row in enumerate(X):
-                bl[i] = mormol(row)[0]
+        backend = self._resolve_backend(X)
+
+        buf = _output_buffer(X, self.copy, out)
+        if buf is None:
+            buf = np.empty(X.shape)
+
+        n_jobs = min(effective_n_jobs(self.n_jobs), len(X))
+        if n_jobs > 1:
+            np.subtract(X, self._get_baselines(X, backend, n_jobs), out=buf)
+            return buf
+
+        # Blockwise, so the temporaries of the fit never span the whole of X
+        for start, stop in _row_blocks(X, BLOCK_BYTES // _BASELINE_WORKSPACE):
+            bl = self._get_baselines(X[start:stop], backend, 1)
+            np.subtract(X[start:stop], bl, out=buf[start:stop])
+        return buf
+
+    def _resolve_backend(self, X):
+        backends = baseline_backends[self.method]
+        if self.engine == "auto":
+            return select_backend(X, self.method)
+        if self.engine in backends:
+            return self.engine
+        if self.engine == "native":
+            # Methods without a native backend, e.g. ones added with
+            # register_backend, use pybaselines or their first backend
+            return "pybaselines" if "pybaselines" in backends else next(iter(backends))
+        raise ValueError(f"Engine {self.engine} does not exist for method {self.method}. "
+                         f"Available engines: {', '.join(backends)}.")
+
+    def _get_baselines(self, X, backend, n_jobs):
+        if self.cache is None:
+            return self._estimate_baselines(X, backend, n_jobs)
+        return self._estimate_baselines_cached(X, backend, n_jobs)
+
+    def _estimate_baselines(self, X, backend, n_jobs):
+        n_jobs = min(n_jobs, len(X))
+
+        if n_jobs <= 1:
+            return fit_baselines(X, self.method, backend)
+
+        # Several chunks per worker to balance uneven fitting times.
+        # Only the rows of a chunk are sent to a worker, never all of X.
+        bounds = np.linspace(0, len(X), min(4 * n_jobs, len(X)) + 1,
+                             dtype=int)
+        func = baseline_backends[self.method][backend]
+        bl = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_baselines_blockwise)(func, X[start:stop])
+            for start, stop in zip(bounds[:-1], bounds[1:]))
+        return np.concatenate(bl)
+
+    def _estimate_baselines_cached(self, X, backend, n_jobs):
+        keys = self.cache.make_keys(X, self.method, engine=backend)
+        bl = np.zeros(X.shape)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                bl[i] = cached
 
-        elif self.method == "rolling ball":
-            for i, row in enumerate(X):
-                bl[i] = rolling_ball(row)[0]
+        if missing:
+            bl[missing] = self._estimate_baselines(X[missing], backend, n_jobs)
+            for i in missing:
+                self.cache.put(keys[i], bl[i])
 
-        elif self.method == "beads":
-            for i, row in enumerate(X):
-                bl[i] = beads(row)[0]
+        return bl
 
-        else:
-            raise ValueError(f"Method {self.method} does not exist.")
 
-        return X - bl
+class RangeLimiter(StreamingMixin, BaseEstimator, TransformerMixin):
+    """Cut spectra to a given range.
 
+    With copy=False, the result is always a numpy view of the input, also
+    for DataFrames, instead of a (lazily) copied DataFrame.
+    """
 
-class RangeLimiter(BaseEstimator, TransformerMixin):
-    def __init__(self, lim=(None, None), reference=None):
+    def __init__(self, lim=(None, None), reference=None, copy=True):
         self.lim = lim
         self.reference = reference
+        self.copy = copy
 
     def fit(self, X, y=None):
         self.lim = list(self.lim)
@@ -64,10 +219,21 @@ class RangeLimiter(BaseEstimator, TransformerMixin):
         else:
             self.lim_ = [self.lim[0], self.lim[1] + 1]
 
+        self.n_features_in_ = np.shape(X)[1]
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Resolve the range on the first chunk, later chunks are only checked."""
+        if not hasattr(self, "lim_"):
+            return self.fit(X)
+        if np.shape(X)[1] != self.n_features_in_:
+            raise ValueError("Chunk has a different number of features than the first one.")
         return self
 
     def transform(self, X, y=None):
-        if isinstance(X, pd.DataFrame):
+        if isinstance(X, pd.DataFrame) and not self.copy:
+            result = X.to_numpy()[:, self.lim_[0]:self.lim_[1]]
+        elif isinstance(X, pd.DataFrame):
             result = X.iloc[:, self.lim_[0]:self.lim_[1]]
         else:
             result = X[:, self.lim_[0]:self.lim_[1]]
@@ -107,35 +273,174 @@ class RangeLimiter(BaseEstimator, TransformerMixin):
                 "Index out of range. Please check the provided indices.")
 
 
-class SavGolFilter(BaseEstimator, TransformerMixin):
+class SavGolFilter(StreamingMixin, BaseEstimator, TransformerMixin):
     """Class to smooth spectral data using a Savitzky-Golay Filter."""
 
-    def __init__(self, window=15, poly=3):
-        """Initialize window size and polynomial order of the Savitzky-Golay Filter"""
+    def __init__(self, window=15, poly=3, copy=True):
+        """Initialize window size and polynomial order of the Savitzky-Golay Filter.
+
+        With copy=False, float arrays are smoothed in place, block by block.
+        """
         self.window = window
         self.poly = poly
+        self.copy = copy
 
     def fit(self, X, y=None):
         return self
 
-    def transform(self, X, y=None):
-        X_smooth = savgol_filter(
-            X, window_length=self.window, polyorder=self.poly)
+    def transform(self, X, y=None, out=None):
+        """Smooth X and shift each spectrum to a minimum of 0.
+
+        Args:
+            X (array-like): Spectra, one per row.
+            out (numpy.ndarray, optional): Array to write the smoothed
+                spectra to. May be X itself. Defaults to None.
+
+        Returns:
+            numpy.ndarray: Smoothed spectra.
+        """
+        buf = _output_buffer(X, self.copy, out)
+        if buf is None:
+            X_smooth, = savgol_derivatives(X, self.window, self.poly, (0,))
+            X_smooth -= X_smooth.min(axis=1, keepdims=True)
+            return X_smooth
+
+        X = np.asarray(X)
+        for start, stop in _row_blocks(X):
+            X_smooth, = savgol_derivatives(X[start:stop], self.window,
+                                           self.poly, (0,))
+            np.subtract(X_smooth, X_smooth.min(axis=1, keepdims=True),
+                        out=buf[start:stop])
+        return buf
+
+
+class PeakPicker(StreamingMixin, BaseEstimator, TransformerMixin):
+    """Select the intensities at the peaks of the mean spectrum.
+
+    Only the peak positions are stored (peak_indices). If area_window is
+    given, transform returns the summed intensity in a window of that many
+    points centered on each peak instead of the intensity at the peak. It
+    must be odd; windows are cut off at the ends of the spectra.
+
+    With partial_fit, the mean spectrum is a running mean over all chunks
+    seen so far, so the peaks (and the output width) may change between chunks.
+    """
+
+    def __init__(self, min_dist=None, area_window=None):
+        self.min_dist = min_dist
+        self.area_window = area_window
 
-        return (X_smooth.T - X_smooth.min(axis=1)).T
+    def fit(self, X, y=None):
+        for attr in ("sum_", "n_samples_seen_"):
+            if hasattr(self, attr):
+                delattr(self, attr)
+        return self.partial_fit(X)
+
+    def partial_fit(self, X, y=None):
+        """Update the mean spectrum with a chunk of spectra and pick its peaks again."""
+        if self.area_window is not None and self.area_window % 2 == 0:
+            raise ValueError("area_window must be odd.")
+
+        X = np.asarray(X)
+        if not hasattr(self, "sum_"):
+            self.sum_ = np.zeros(X.shape[1])
+            self.n_samples_seen_ = 0
+        elif X.shape[1] != self.n_features_in_:
+            raise ValueError("Chunk has a different number of features than the first one.")
+
+        self.sum_ += X.sum(axis=0)
+        self.n_samples_seen_ += len(X)
+
+        X_mean = self.sum_ / self.n_samples_seen_
+        self.peak_indices = find_peaks(X_mean, distance=self.min_dist)[0]
+        self.n_features_in_ = X.shape[1]
+        return self
 
+    def peak_matrix(self):
+        """One-hot encoding of the peak positions.
 
-class PeakPicker(BaseEstimator, TransformerMixin):
-    def __init__(self, min_dist=None):
-        self.min_dist = min_dist
+        Returns:
+            scipy.sparse.csr_matrix: Boolean matrix of shape (n_peaks, n_features) with one True entry per row.
+        """
+        n_peaks = len(self.peak_indices)
+        return csr_matrix((np.ones(n_peaks, dtype=bool),
+                           self.peak_indices,
+                           np.arange(n_peaks + 1)),
+                          shape=(n_peaks, self.n_features_in_))
+
+    def transform(self, X, y=None):
+        X = np.asarray(X)
+        if self.area_window is None:
+            return X[:, self.peak_indices]
+
+        # Window sums of all peaks from differences of the cumulative sum
+        half = self.area_window // 2
+        lower = np.maximum(self.peak_indices - half, 0)
+        upper = np.minimum(self.peak_indices + half + 1, X.shape[1])
+        cumsum = np.zeros((X.shape[0], X.shape[1] + 1))
+        np.cumsum(X, axis=1, out=cumsum[:, 1:])
+        return cumsum[:, upper] - cumsum[:, lower]
+
+
+def is_rowwise(step):
+    """Whether a transformer processes each spectrum independently of the others."""
+    return isinstance(step, (RangeLimiter, BaselineCorrector, SavGolFilter,
+                             Normalizer))
+
+
+class FusedPipeline(StreamingMixin, BaseEstimator, TransformerMixin):
+    """Chain of row-wise transformers applied block by block.
+
+    Instead of running every step over the whole matrix and materializing
+    each intermediate result, a block of rows is passed through all steps
+    before the next block is processed, so the intermediates stay small
+    enough to remain in the CPU cache. The result is the same as applying
+    the steps one after another (up to floating point rounding).
+
+    Args:
+        steps (list): (name, transformer) tuples. Only RangeLimiter,
+            BaselineCorrector, SavGolFilter and sklearn's Normalizer are
+            supported, as all of them work row by row.
+        block_bytes (int, optional): Approximate size of one row block of
+            the input. Defaults to 1 MiB.
+    """
+
+    def __init__(self, steps, block_bytes=2**20):
+        self.steps = steps
+        self.block_bytes = block_bytes
 
     def fit(self, X, y=None):
-        X_mean = X.mean(axis=0)
-        self.peak_indices = find_peaks(X_mean, distance=self.min_dist)[0]
-        self.peaks_ = np.zeros((len(self.peak_indices), X.shape[1]), dtype=bool)
-        for i, j in enumerate(self.peak_indices):
-            self.peaks_[i, j] = True
+        for name, step in self.steps:
+            if not is_rowwise(step):
+                raise TypeError(f"Step {name} is not a row-wise transformer.")
+
+        # Row-wise steps only need the shape of their input, which is
+        # obtained by passing (a copy of) the first spectrum through the
+        # chain, as steps with copy=False would overwrite it.
+        Xt = np.array(np.asarray(X)[:1])
+        for _, step in self.steps:
+            Xt = step.fit(Xt).transform(Xt)
+        self.n_features_in_ = np.shape(X)[1]
+        self.n_features_out_ = np.shape(Xt)[1]
+
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Fit on the first chunk. All steps are row-wise, so later chunks are only checked."""
+        if not hasattr(self, "n_features_out_"):
+            return self.fit(X)
+        if np.shape(X)[1] != self.n_features_in_:
+            raise ValueError("Chunk has a different number of features than the first one.")
         return self
 
     def transform(self, X, y=None):
-        return X[:, self.peak_indices]
+        X = np.asarray(X)
+        result = np.empty((len(X), self.n_features_out_))
+
+        for start, stop in _row_blocks(X, self.block_bytes):
+            Xt = X[start:stop]
+            for _, step in self.steps:
+                Xt = step.transform(Xt)
+            result[start:stop] = Xt
+
+        return result
@@ -0,0 +1,144 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class StageStats:
+    """Resource usage of one processing stage, summed over all calls.
+
+    Attributes:
+        wall_time (float): Elapsed time in seconds. For stages run by parallel
+            workers, their share of the elapsed time of the parallel section.
+        worker_time (float): Elapsed time summed over all calls, i.e. over
+            all workers. The same as wall_time for stages run in one process.
+        cpu_time (float): CPU time of the processes that ran the stage in seconds.
+        peak_memory (int): Highest memory allocated on top of the memory in
+            use when the stage started, in bytes (maximum over all calls).
+        n_spectra (int): Number of spectra processed.
+        n_calls (int): Number of times the stage was run, e.g. once per chunk.
+    """
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.worker_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory = 0
+        self.n_spectra = 0
+        self.n_calls = 0
+
+    @property
+    def throughput(self):
+        """Spectra per second of wall time."""
+        return self.n_spectra / self.wall_time if self.wall_time > 0 else float("inf")
+
+    def merge(self, other):
+        self.wall_time += other.wall_time
+        self.worker_time += other.worker_time
+        self.cpu_time += other.cpu_time
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        self.n_spectra += other.n_spectra
+        self.n_calls += other.n_calls
+
+
+class StageProfile:
+    """Per-stage wall time, CPU time, peak memory and throughput of a run.
+
+    Stages are measured with the stage context manager. Profiles recorded in
+    worker processes are combined with merge_parallel. Peak memory is measured with
+    tracemalloc, which is started for the duration of a stage if it is not
+    tracing already.
+
+    Args:
+        trace_memory (bool, optional): Whether to measure peak memory, which slows down allocations. Defaults to True.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, n_spectra=0):
+        """Measure the code run inside the with block as stage name."""
+        start_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stats = StageStats()
+            stats.wall_time = time.perf_counter() - wall_start
+            stats.worker_time = stats.wall_time
+            stats.cpu_time = time.process_time() - cpu_start
+            if self.trace_memory:
+                stats.peak_memory = max(0, tracemalloc.get_traced_memory()[1] - mem_start)
+            if start_tracing:
+                tracemalloc.stop()
+            stats.n_spectra = n_spectra
+            stats.n_calls = 1
+            self.stages.setdefault(name, StageStats()).merge(stats)
+
+    def merge(self, other):
+        """Add the measurements of another profile of stages that ran one after another."""
+        for name, stats in other.stages.items():
+            self.stages.setdefault(name, StageStats()).merge(stats)
+        return self
+
+    def merge_parallel(self, others, wall_time):
+        """Add the measurements of profiles recorded by parallel worker processes.
+
+        Summing the workers' elapsed times would overstate the real time and
+        understate the throughput. They are kept as worker_time, and the
+        elapsed time of the parallel section (measured by the caller) is
+        split among the stages in proportion to it.
+
+        Args:
+            others (list of StageProfile): Profiles of the workers.
+            wall_time (float): Elapsed time of the parallel section in seconds.
+        """
+        combined = StageProfile(self.trace_memory)
+        for other in others:
+            combined.merge(other)
+        total = sum(s.worker_time for s in combined.stages.values())
+        for stats in combined.stages.values():
+            stats.wall_time = wall_time * stats.worker_time / total if total > 0 else 0.0
+        return self.merge(combined)
+
+    def to_frame(self):
+        """Summary table with one row per stage."""
+        return pd.DataFrame(
+            {name: {"wall_time": s.wall_time,
+                    "worker_time": s.worker_time,
+                    "cpu_time": s.cpu_time,
+                    "peak_memory": s.peak_memory,
+                    "n_spectra": s.n_spectra,
+                    "n_calls": s.n_calls,
+                    "throughput": s.throughput}
+             for name, s in self.stages.items()}).T
+
+    def __str__(self):
+        return "\n".join(
+            f"{name}: {s.wall_time:.3f} s wall, {s.worker_time:.3f} s summed over workers, "
+            f"{s.cpu_time:.3f} s CPU, "
+            f"{s.peak_memory / 2**20:.1f} MiB peak, {s.throughput:.1f} spectra/s"
+            for name, s in self.stages.items())
+
+
+@contextmanager
+def optional_stage(profile, name, n_spectra=0):
+    """profile.stage(name, n_spectra) if a profile is given, otherwise a no-op."""
+    if profile is None:
+        yield
+    else:
+        with profile.stage(name, n_spectra):
+            yield
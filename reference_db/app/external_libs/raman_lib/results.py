@@ -0,0 +1,327 @@
+import numpy as np
+from scipy.stats import binom, chi2
+
+# np.trapz was renamed in NumPy 2.0
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def _as_trials(values):
+    """values as a 2D array with one row per trial."""
+    values = np.asarray(values)
+    return values.reshape(1, -1) if values.ndim == 1 else values
+
+
+def confusion_matrices(y_true, y_pred, labels=None):
+    """Confusion matrix of every trial.
+
+    Args:
+        y_true (array-like): True labels, shape (n_samples,).
+        y_pred (array-like): Predicted labels, shape (n_trials, n_samples).
+        labels (array-like, optional): Classes in the order of the rows and
+            columns. Defaults to None (all classes in y_true and y_pred, sorted).
+
+    Returns:
+        numpy.ndarray: Counts of shape (n_trials, n_classes, n_classes), true
+            labels along the rows and predicted labels along the columns, as
+            in sklearn.metrics.confusion_matrix.
+    """
+    y_true = np.asarray(y_true).ravel()
+    y_pred = _as_trials(y_pred)
+    if labels is None:
+        labels = np.union1d(y_true, y_pred)
+    labels = np.asarray(labels)
+    n_trials, n_classes = len(y_pred), len(labels)
+
+    order = np.argsort(labels)
+
+    def codes(values):
+        pos = np.clip(np.searchsorted(labels, values, sorter=order), 0, n_classes - 1)
+        idx = order[pos]
+        return np.where(labels[idx] == values, idx, -1)
+
+    true_codes = np.broadcast_to(codes(y_true), y_pred.shape)
+    pred_codes = codes(y_pred)
+    # Samples with labels outside of labels are not counted
+    valid = (true_codes >= 0) & (pred_codes >= 0)
+    cells = (np.arange(n_trials)[:, None] * n_classes + true_codes) * n_classes + pred_codes
+    counts = np.bincount(cells[valid], minlength=n_trials * n_classes**2)
+    return counts.reshape(n_trials, n_classes, n_classes)
+
+
+def mcnemar_tables(y_true, y_pred1, y_pred2):
+    """2x2 contingency tables of two models for every trial.
+
+    Same layout as mlxtend.evaluate.mcnemar_table: [0, 0] both correct,
+    [0, 1] only model 1 correct, [1, 0] only model 2 correct, [1, 1] both wrong.
+
+    Args:
+        y_true (array-like): True labels, shape (n_samples,).
+        y_pred1 (array-like): Predictions of model 1, shape (n_samples,) or (n_trials, n_samples).
+        y_pred2 (array-like): Predictions of model 2, shape (n_samples,) or (n_trials, n_samples).
+
+    Returns:
+        numpy.ndarray: Tables of shape (n_trials, 2, 2).
+    """
+    y_true = np.asarray(y_true).ravel()
+    correct1 = _as_trials(y_pred1) == y_true
+    correct2 = _as_trials(y_pred2) == y_true
+    correct1, correct2 = np.broadcast_arrays(correct1, correct2)
+    return np.stack([
+        np.stack([(correct1 & correct2).sum(axis=1), (correct1 & ~correct2).sum(axis=1)], axis=1),
+        np.stack([(~correct1 & correct2).sum(axis=1), (~correct1 & ~correct2).sum(axis=1)], axis=1),
+    ], axis=1)
+
+
+def mcnemar_tests(tables, corrected=True, exact=False):
+    """McNemar test of every contingency table.
+
+    Same statistics as mlxtend.evaluate.mcnemar, including its result for
+    tables without discordant pairs (statistic inf and p-value 0 for the
+    chi-squared test).
+
+    Args:
+        tables (array-like): Tables of shape (n_trials, 2, 2) or (2, 2).
+        corrected (bool, optional): Whether to use the continuity correction. Defaults to True.
+        exact (bool, optional): Whether to use the exact binomial test. Defaults to False.
+
+    Returns:
+        tuple: Statistics and p-values, each of shape (n_trials,).
+    """
+    tables = np.asarray(tables).reshape(-1, 2, 2)
+    b, c = tables[:, 0, 1], tables[:, 1, 0]
+    if exact:
+        stat = np.minimum(b, c)
+        return stat, np.minimum(binom.cdf(stat, b + c, 0.5) * 2.0, 1.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if corrected:
+            stat = (np.abs(b - c) - 1.0)**2 / (b + c)
+        else:
+            stat = (b - c)**2 / (b + c).astype(float)
+    return stat, chi2.sf(stat, 1)
+
+
+def roc_curves(y_true, scores, pos_label=1):
+    """ROC curve of every trial.
+
+    All curves have n_samples + 1 points, so they can be stored in one
+    array. Samples with equal scores give repeated points instead of being
+    dropped as in sklearn.metrics.roc_curve, which does not change the
+    shape of the curves or their area.
+
+    Args:
+        y_true (array-like): True labels, shape (n_samples,).
+        scores (array-like): Confidence scores of the positive class, shape (n_trials, n_samples).
+        pos_label (optional): Label of the positive class. Defaults to 1.
+
+    Returns:
+        fpr (numpy.ndarray): False positive rates, shape (n_trials, n_samples + 1).
+        tpr (numpy.ndarray): True positive rates, shape (n_trials, n_samples + 1).
+    """
+    positive = np.asarray(y_true).ravel() == pos_label
+    scores = _as_trials(scores).astype(float)
+    n_trials, n_samples = scores.shape
+
+    order = np.argsort(-scores, axis=1, kind="mergesort")
+    sorted_scores = np.take_along_axis(scores, order, axis=1)
+    tps = np.cumsum(positive[order], axis=1)
+    fps = np.arange(1, n_samples + 1) - tps
+
+    # Move every sample to the last one with the same score, so tied
+    # samples are counted at once
+    is_last = np.ones((n_trials, n_samples), dtype=bool)
+    is_last[:, :-1] = sorted_scores[:, :-1] != sorted_scores[:, 1:]
+    last = np.where(is_last, np.arange(n_samples), n_samples - 1)
+    last = np.minimum.accumulate(last[:, ::-1], axis=1)[:, ::-1]
+    tps = np.take_along_axis(tps, last, axis=1)
+    fps = np.take_along_axis(fps, last, axis=1)
+
+    zeros = np.zeros((n_trials, 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fpr = np.hstack((zeros, fps / fps[:, -1:]))
+        tpr = np.hstack((zeros, tps / tps[:, -1:]))
+    return fpr, tpr
+
+
+def roc_auc(fpr, tpr):
+    """Area under each ROC curve."""
+    return _trapezoid(tpr, fpr, axis=-1)
+
+
+def interpolate_curves(x, y, x_new):
+    """Piecewise linear interpolation of every row, like np.interp on each one.
+
+    Args:
+        x (numpy.ndarray): Increasing x values of each curve, shape (n_curves, n_points).
+        y (numpy.ndarray): y values of each curve, shape (n_curves, n_points).
+        x_new (numpy.ndarray): Common x values to interpolate at, shape (n_new,).
+
+    Returns:
+        numpy.ndarray: Interpolated values, shape (n_curves, n_new).
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    x_new = np.asarray(x_new, dtype=float)
+    n_curves, n_points = x.shape
+
+    # Search all curves at once by moving each one to its own x range
+    span = (max(np.nanmax(x), x_new.max()) - min(np.nanmin(x), x_new.min())) + 1
+    offsets = np.arange(n_curves)[:, None] * span
+    flat = (x + offsets).ravel()
+    right = np.searchsorted(flat, (x_new + offsets).ravel(), side="right").reshape(n_curves, -1)
+    right -= (np.arange(n_curves) * n_points)[:, None]
+    right = np.clip(right, 1, n_points - 1)
+    left = right - 1
+
+    x0, x1 = np.take_along_axis(x, left, axis=1), np.take_along_axis(x, right, axis=1)
+    y0, y1 = np.take_along_axis(y, left, axis=1), np.take_along_axis(y, right, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        interp = y0 + (y1 - y0) * (x_new - x0) / (x1 - x0)
+    # Outside of the curve or on a vertical step, as np.interp
+    interp = np.where(x1 == x0, y0, interp)
+    interp = np.where(x_new >= x[:, -1:], y[:, -1:], interp)
+    interp = np.where(x_new < x[:, :1], y[:, :1], interp)
+    return interp
+
+
+def mean_roc_curve(fpr, tpr, n_points=200):
+    """Mean of the ROC curves, interpolated on an even grid of false positive rates.
+
+    Returns:
+        mean_fpr (numpy.ndarray): Grid of false positive rates, shape (n_points,).
+        tprs (numpy.ndarray): Interpolated true positive rates of each curve, shape (n_curves, n_points).
+        mean_tpr (numpy.ndarray): Mean true positive rates, shape (n_points,).
+    """
+    mean_fpr = np.linspace(0, 1, n_points)
+    tprs = interpolate_curves(fpr, tpr, mean_fpr)
+    tprs[:, 0] = 0.0
+    mean_tpr = tprs.mean(axis=0)
+    mean_tpr[-1] = 1
+    return mean_fpr, tprs, mean_tpr
+
+
+def bootstrap_weights(n_samples, n_boot=1000, random_state=None):
+    """How often each sample is drawn in each bootstrap resample, shape (n_boot, n_samples)."""
+    rng = np.random.default_rng(random_state)
+    return rng.multinomial(n_samples, np.full(n_samples, 1 / n_samples), size=n_boot)
+
+
+def bootstrap_accuracy(y_true, y_pred, n_boot=1000, random_state=None):
+    """Accuracy of every trial on n_boot bootstrap resamples of the samples.
+
+    All trials are evaluated on the same resamples.
+
+    Returns:
+        numpy.ndarray: Accuracies of shape (n_trials, n_boot).
+    """
+    y_true = np.asarray(y_true).ravel()
+    correct = (_as_trials(y_pred) == y_true).astype(float)
+    weights = bootstrap_weights(len(y_true), n_boot, random_state)
+    return correct @ weights.T / len(y_true)
+
+
+def bootstrap_auc(y_true, scores, n_boot=1000, random_state=None, pos_label=1,
+                  max_elements=2**22):
+    """ROC AUC of every trial on n_boot bootstrap resamples of the samples.
+
+    The AUC is computed as the (weighted) probability that a positive sample
+    scores higher than a negative one, counting ties half. All trials are
+    evaluated on the same resamples, in batches of at most max_elements
+    values.
+
+    Returns:
+        numpy.ndarray: AUCs of shape (n_trials, n_boot). Resamples without
+            positive or negative samples give NaN.
+    """
+    positive = np.asarray(y_true).ravel() == pos_label
+    scores = _as_trials(scores).astype(float)
+    n_trials, n_samples = scores.shape
+    weights = bootstrap_weights(n_samples, n_boot, random_state).astype(float)
+
+    order = np.argsort(scores, axis=1, kind="mergesort")
+    sorted_scores = np.take_along_axis(scores, order, axis=1)
+    sorted_positive = positive[order]
+    # First and last position of the group of tied scores of every sample
+    is_first = np.ones((n_trials, n_samples), dtype=bool)
+    is_first[:, 1:] = sorted_scores[:, 1:] != sorted_scores[:, :-1]
+    is_last = np.ones((n_trials, n_samples), dtype=bool)
+    is_last[:, :-1] = is_first[:, 1:]
+    positions = np.arange(n_samples)
+    first = np.maximum.accumulate(np.where(is_first, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(is_last, positions, n_samples - 1)[:, ::-1],
+                                 axis=1)[:, ::-1]
+
+    aucs = np.empty((n_trials, n_boot))
+    batch = max(1, max_elements // max(1, n_trials * n_samples))
+    for start in range(0, n_boot, batch):
+        w = weights[start:start + batch][:, order]  # (batch, n_trials, n_samples)
+        w_neg = np.where(sorted_positive, 0.0, w)
+        w_pos = w - w_neg
+        cum_neg = np.concatenate((np.zeros(w.shape[:2] + (1,)), np.cumsum(w_neg, axis=2)), axis=2)
+        # Negatives scoring lower, and tied negatives counted half
+        below = np.take_along_axis(cum_neg, np.broadcast_to(first, w.shape), axis=2)
+        tied = np.take_along_axis(cum_neg, np.broadcast_to(last + 1, w.shape), axis=2) - below
+        n_pos, n_neg = w_pos.sum(axis=2), w_neg.sum(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            aucs[:, start:start + batch] = ((w_pos * (below + tied / 2)).sum(axis=2)
+                                            / (n_pos * n_neg)).T
+    return aucs
+
+
+def confidence_interval(values, ci=0.95, axis=-1):
+    """Percentile interval holding the central ci share of the values (e.g. bootstrap estimates).
+
+    Returns:
+        numpy.ndarray: Lower and upper bounds, stacked along the last axis.
+    """
+    alpha = (1 - ci) / 2
+    return np.moveaxis(np.nanquantile(values, [alpha, 1 - alpha], axis=axis), 0, -1)
+
+
+def summarize_trials(y_true, y_pred, conf_scores=None, y_dummy=None, labels=None,
+                     n_boot=1000, ci=0.95, random_state=None, pos_label=1):
+    """Evaluate the stacked predictions of all trials of a repeated cross-validation.
+
+    Args:
+        y_true (array-like): True labels, shape (n_samples,).
+        y_pred (array-like): Predicted labels, shape (n_trials, n_samples),
+            e.g. CrossValidator.predictions_["y_pred"].
+        conf_scores (array-like, optional): Confidence scores of the positive
+            class, shape (n_trials, n_samples). Defaults to None (no ROC analysis).
+        y_dummy (array-like, optional): Predictions of a baseline model to
+            compare with in a McNemar test, shape (n_samples,) or
+            (n_trials, n_samples). Defaults to None (no test).
+        labels (array-like, optional): Classes of the confusion matrices. Defaults to None.
+        n_boot (int, optional): Number of bootstrap resamples. Defaults to 1000.
+        ci (float, optional): Coverage of the confidence intervals. Defaults to 0.95.
+        random_state (int, optional): Seed of the bootstrap resamples. Defaults to None.
+        pos_label (optional): Label of the positive class for the ROC analysis. Defaults to 1.
+
+    Returns:
+        dict: Confusion matrices ("confusion_matrices") and accuracies with
+            bootstrap confidence intervals ("accuracy", "accuracy_ci") of all
+            trials; with conf_scores, also their ROC curves ("fpr", "tpr"),
+            the mean curve ("mean_fpr", "mean_tpr") and AUCs ("auc", "auc_ci");
+            with y_dummy, McNemar tables, statistics and p-values
+            ("mcnemar_tables", "mcnemar_statistic", "p_value").
+    """
+    y_true = np.asarray(y_true).ravel()
+    y_pred = _as_trials(y_pred)
+    summary = {"confusion_matrices": confusion_matrices(y_true, y_pred, labels),
+               "accuracy": (y_pred == y_true).mean(axis=1),
+               "accuracy_ci": confidence_interval(
+                   bootstrap_accuracy(y_true, y_pred, n_boot, random_state), ci)}
+
+    if conf_scores is not None:
+        fpr, tpr = roc_curves(y_true, conf_scores, pos_label)
+        summary["fpr"], summary["tpr"] = fpr, tpr
+        summary["mean_fpr"], _, summary["mean_tpr"] = mean_roc_curve(fpr, tpr)
+        summary["auc"] = roc_auc(fpr, tpr)
+        summary["auc_ci"] = confidence_interval(
+            bootstrap_auc(y_true, conf_scores, n_boot, random_state, pos_label), ci)
+
+    if y_dummy is not None:
+        tables = mcnemar_tables(y_true, y_dummy, y_pred)
+        summary["mcnemar_tables"] = tables
+        summary["mcnemar_statistic"], summary["p_value"] = mcnemar_tests(tables)
+
+    return summary
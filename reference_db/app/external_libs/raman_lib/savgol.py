@@ -0,0 +1,100 @@
+from functools import lru_cache
+from math import factorial
+
+import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import fftconvolve, savgol_coeffs
+
+# Windows at least this wide are convolved via FFT instead of directly
+FFT_WINDOW = 65
+
+
+@lru_cache(maxsize=64)
+def savgol_kernel(window, poly, deriv=0):
+    """Cached Savitzky-Golay convolution coefficients.
+
+    Args:
+        window (int): Window length (must be odd).
+        poly (int): Polynomial order.
+        deriv (int, optional): Order of the derivative. Defaults to 0.
+
+    Returns:
+        numpy.ndarray: Read-only coefficients as used by scipy.signal.savgol_filter.
+    """
+    kernel = savgol_coeffs(window, poly, deriv=deriv)
+    kernel.flags.writeable = False
+    return kernel
+
+
+@lru_cache(maxsize=64)
+def _edge_operators(window, poly, deriv):
+    """Linear operators for the polynomial fits at both edges of a spectrum.
+
+    Mirrors the "interp" mode of scipy.signal.savgol_filter: a polynomial is
+    fitted to the first (last) window points and its derivative evaluated
+    at the first (last) window // 2 positions. Both steps are linear in the
+    data, so they are combined into one (window // 2, window) matrix per edge.
+    """
+    halflen = window // 2
+    powers = np.arange(poly + 1)
+    fit = np.linalg.pinv(np.vander(np.arange(window), poly + 1, increasing=True))
+
+    # d^deriv/dt^deriv of t**k is k! / (k - deriv)! * t**(k - deriv)
+    scale = np.array([factorial(k) / factorial(k - deriv) if k >= deriv else 0
+                      for k in powers])
+    exponents = np.maximum(powers - deriv, 0)
+
+    def evaluate(positions):
+        return (scale * positions[:, None].astype(float)**exponents) @ fit
+
+    left = evaluate(np.arange(halflen))
+    right = evaluate(np.arange(window - halflen, window))
+    left.flags.writeable = False
+    right.flags.writeable = False
+    return left, right
+
+
+def savgol_derivatives(X, window, poly=3, derivs=(0, 1, 2), fft=None):
+    """Smooth the rows of X and compute their derivatives in one pass.
+
+    Equivalent to calling scipy.signal.savgol_filter once per entry of
+    derivs, but the coefficients are cached and, for wide windows, the
+    Fourier transform of X is shared by all derivatives.
+
+    Args:
+        X (array-like): Spectra, one per row.
+        window (int): Window length of the filter (must be odd).
+        poly (int, optional): Polynomial order. Defaults to 3.
+        derivs (tuple, optional): Orders of the derivatives to compute, 0 being the smoothed signal. Defaults to (0, 1, 2).
+        fft (bool, optional): Whether to convolve via FFT. If None, FFT is used for windows of at least FFT_WINDOW points. Defaults to None.
+
+    Returns:
+        list: One array with the shape of X per entry of derivs.
+    """
+    X = np.ascontiguousarray(X, dtype=float)
+    if window > X.shape[-1]:
+        raise ValueError("window must be less than or equal to the size of X.")
+    if fft is None:
+        fft = window >= FFT_WINDOW
+
+    kernels = np.array([savgol_kernel(window, poly, d) for d in derivs])
+
+    if fft:
+        results = fftconvolve(X[None], kernels[:, None, :],
+                              mode="full", axes=-1)
+        results = results[..., window // 2:window // 2 + X.shape[-1]]
+    else:
+        results = np.empty((len(derivs),) + X.shape)
+        for i, kernel in enumerate(kernels):
+            convolve1d(X, kernel, axis=-1, mode="constant", output=results[i])
+
+    for i, d in enumerate(derivs):
+        left, right = _edge_operators(window, poly, d)
+        halflen = window // 2
+        if halflen:
+            # einsum rather than @, since BLAS may round a row differently
+            # depending on the number of rows passed along with it
+            results[i, :, :halflen] = np.einsum("nw,hw->nh", X[:, :window], left)
+            results[i, :, -halflen:] = np.einsum("nw,hw->nh", X[:, -window:], right)
+
+    return list(results)
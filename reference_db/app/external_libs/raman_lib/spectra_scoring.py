@@ -1,11 +1,25 @@
+import hashlib
+import logging
+import os
 import numpy as np
 import time
 import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
 from scipy.integrate import simpson
-from scipy.signal import argrelmax, argrelmin, savgol_filter
+from sklearn.model_selection import ParameterGrid
 from sklearn.preprocessing import normalize
 
+from .peaks import RaggedPeaks
 from .preprocessing import BaselineCorrector, RangeLimiter
+from .profiling import StageProfile, optional_stage
+from .savgol import savgol_derivatives
+
+try:
+    from . import jit_kernels
+except ImportError:  # numba is not installed or does not match NumPy
+    jit_kernels = None
+
+scoring_logger = logging.getLogger(__name__)
 
 score_names = {0: "No Score",
                1: "Median Height",
@@ -34,12 +48,14 @@ def limit_range(data, limits):
     return rl.transform(data)
 
 
-def baseline_correction(data, method="asls"):
+def baseline_correction(data, method="asls", n_jobs=None, cache=None):
     """Estimate and subtract the baseline from a set of spectra.
 
     Args:
         data (pandas.DataFrame): Raw spectral data. Rows represent the individual spectra.
         method (str, optional): Baseline correction method to use. Defaults to "asls".
+        n_jobs (int, optional): Number of worker processes for the baseline fits. None means 1, -1 uses all cores. Defaults to None.
+        cache (BaselineCache, optional): Cache to reuse baselines of previously corrected spectra. Defaults to None.
 
     Returns:
         pandas.DataFrame: Baseline-corrected spectra.
@@ -49,61 +65,151 @@ def baseline_correction(data, method="asls"):
     except AttributeError:
         wns = np.arange(np.shape(data)[-1])
 
-    bl = BaselineCorrector(method=method)
+    bl = BaselineCorrector(method=method, n_jobs=n_jobs, cache=cache)
     data = bl.fit_transform(data)
     data = pd.DataFrame(data, columns=wns)
     return data
 
 
-def peakRecognition(data, data_bl, sg_window, bl_method="asls", threshold=0, min_height=0):
+def peakRecognition(data, data_bl, sg_window, bl_method="asls", threshold=0, min_height=0, cache=None):
     """Determines the number of peaks in each spectrum based on a 2nd derivative Savitzky-Golay-Filter.
 
     Args:
         data (pd.DataFrame): Baseline corrected spectra
         sg_window (int): Window width of the Savitzky-Golay-Filter (must be odd)
+        cache (BaselineCache, optional): Cache to reuse baselines of previously corrected spectra. Defaults to None.
 
     Returns:
-        peaks (list): List of lists with the peaks found in each spectrum
+        peaks (RaggedPeaks): The peaks found in each spectrum
+        deriv (numpy.ndarray): First derivative of the spectra
+    """
+
+    data_sg = first_derivative(data, sg_window, bl_method, cache)
+
+    peaks = RaggedPeaks(*find_peak_positions(data_sg, data_bl, threshold, min_height))
+
+    return peaks, data_sg
+
+
+def first_derivative(data, sg_window, bl_method="asls", cache=None):
+    """First Savitzky-Golay derivative of the max-normalized, baseline-corrected spectra, as used by peakRecognition."""
+    data_sg = baseline_correction(normalize(data, norm="max"), method=bl_method, cache=cache)
+    return savgol_derivatives(data_sg, sg_window, 3, derivs=(1,))[0]
+
+
+class LazyDerivative:
+    """First derivatives of a set of spectra, computed on access.
+
+    Stands in for the derivative matrix returned by score_sort_spectra with
+    detailed=True when it is too large to keep in memory. Indexing computes
+    the derivatives of the selected rows only, e.g. deriv[i] or deriv[10:20],
+    and gives the same values as the full matrix would.
+
+    Args:
+        data (pandas.DataFrame): Range-limited spectra, one per row.
+        sg_window (int): Window width of the Savitzky-Golay-Filter.
+        bl_method (str, optional): Baseline correction method. Defaults to "asls".
     """
 
-    wns = data.columns.astype("float64")
-
-    data_sg = baseline_correction(normalize(data, norm="max"), method=bl_method)
-    data_sg = pd.DataFrame(
-        savgol_filter(data_sg, window_length=sg_window, polyorder=3, deriv=1), columns=wns)
-
-    peaks = []
-
-    for i, row in data_sg.iterrows():
-        row_peaks = np.where(np.diff(np.sign(row)))[0]
-        row_max = argrelmax(row.values)[0]
-        row_min = argrelmin(row.values)[0]
-        # Remove peaks below threshold
-        row_max = [j for j in row_max if row.iloc[j]
-                   > threshold and j < row_peaks[-1]]
-        row_min = [j for j in row_min if row.iloc[j]
-                   < -threshold and j > row_peaks[0]]
-        
-        peaks_max = np.searchsorted(row_peaks, row_max)
-        peaks_min = np.searchsorted(row_peaks, row_min) - 1
-        peaks_tmp = np.unique(np.concatenate((peaks_max, peaks_min)))
-        row_peaks = row_peaks[peaks_tmp]
-        
-        # Remove peaks that are too small
-        row_peaks = [j for j in row_peaks if data_bl.iloc[i, j:j+1].mean() >= min_height]
-        peaks.append(row_peaks)
-
-    return peaks, np.asarray(data_sg)
-
-
-def calc_scores(data, peaks, score_measure, n_peaks_influence):
+    def __init__(self, data, sg_window, bl_method="asls"):
+        self.data = data
+        self.sg_window = sg_window
+        self.bl_method = bl_method
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        single = isinstance(rows, (int, np.integer))
+        selected = self.data.iloc[[rows] if single else rows]
+        deriv = first_derivative(selected, self.sg_window, self.bl_method)
+        return deriv[0, cols] if single else deriv[:, cols]
+
+    def __array__(self, dtype=None, copy=None):
+        deriv = first_derivative(self.data, self.sg_window, self.bl_method)
+        return deriv if dtype is None else deriv.astype(dtype)
+
+
+def find_peak_positions(deriv, data_bl, threshold=0, min_height=0, jit=None):
+    """Locate peaks as zero crossings of the first derivative, for all spectra at once.
+
+    A zero crossing counts as a peak if it is the next crossing after a local
+    maximum of the derivative above threshold, or the last crossing before a
+    local minimum below -threshold, and the baseline-corrected intensity at
+    that position is at least min_height.
+
+    Args:
+        deriv (numpy.ndarray): First derivative of the spectra, one per row.
+        data_bl (array-like): Baseline-corrected spectra.
+        threshold (float, optional): Minimum absolute value of the derivative extrema. Defaults to 0.
+        min_height (float, optional): Minimum intensity of a peak. Defaults to 0.
+        jit (bool, optional): Whether to use the compiled kernel. If None, it is used if numba is installed. Defaults to None.
+
+    Returns:
+        indptr (numpy.ndarray): The peaks of spectrum i are indices[indptr[i]:indptr[i+1]].
+        indices (numpy.ndarray): Positions of the peaks, sorted within each spectrum.
+    """
+    if jit is None:
+        jit = jit_kernels is not None
+    if jit:
+        return jit_kernels.peak_positions(
+            np.ascontiguousarray(deriv, dtype=float),
+            np.ascontiguousarray(data_bl, dtype=float),
+            float(threshold), float(min_height))
+
+    deriv = np.asarray(deriv)
+    n_spectra, n_points = deriv.shape
+    positions = np.arange(n_points)
+
+    signs = np.sign(deriv)
+    crossings = signs[:, 1:] != signs[:, :-1]
+    # Last and first crossing of each spectrum (-1 / n_points if there is none)
+    last = np.where(crossings, positions[:-1], -1).max(axis=1, initial=-1)
+    first = np.where(crossings, positions[:-1], n_points).min(axis=1, initial=n_points)
+
+    inner = deriv[:, 1:-1]
+    is_max = np.zeros_like(deriv, dtype=bool)
+    is_min = np.zeros_like(deriv, dtype=bool)
+    is_max[:, 1:-1] = (inner > deriv[:, :-2]) & (inner > deriv[:, 2:])
+    is_min[:, 1:-1] = (inner < deriv[:, :-2]) & (inner < deriv[:, 2:])
+    is_max &= (deriv > threshold) & (positions < last[:, None])
+    is_min &= (deriv < -threshold) & (positions > first[:, None])
+
+    # Next crossing at or after each position, and last crossing before it
+    next_crossing = np.where(crossings, positions[:-1], n_points)
+    next_crossing = np.minimum.accumulate(next_crossing[:, ::-1], axis=1)[:, ::-1]
+    prev_crossing = np.where(crossings, positions[:-1], -1)
+    prev_crossing = np.maximum.accumulate(prev_crossing, axis=1)
+
+    peaks = np.zeros(crossings.shape, dtype=bool)
+    rows, cols = np.nonzero(is_max)
+    peaks[rows, next_crossing[rows, cols]] = True
+    rows, cols = np.nonzero(is_min)
+    peaks[rows, prev_crossing[rows, cols - 1]] = True
+
+    # Remove peaks that are too small
+    peaks &= np.asarray(data_bl)[:, :n_points - 1] >= min_height
+
+    rows, indices = np.nonzero(peaks)
+    indptr = np.zeros(n_spectra + 1, dtype=int)
+    np.cumsum(np.bincount(rows, minlength=n_spectra), out=indptr[1:])
+    return indptr, indices
+
+
+def calc_scores(data, peaks, score_measure, n_peaks_influence, jit=None):
     """Calculates the quality scores for each spectrum
 
     Args:
         data (pandas.DataFrame): Baseline-corrected spectra.
-        peaks (list): List of lists with the peaks found in each spectrum.
+        peaks (RaggedPeaks or list): The peaks found in each spectrum. If the peaks have heights, these are used instead of looking them up in data.
         score_measure (int): Sets intensity measure used for score calculation.
         n_peaks_influence (int): Sets influence of peak number on the score. 
+        jit (bool, optional): Whether to use the compiled kernel for median peak heights. If None, it is used if numba is installed. Defaults to None.
         detailed (bool): Whether the individual parts of the score (height/area and number of peaks) should be returned. Default: False
 
     Returns:
@@ -112,43 +218,54 @@ def calc_scores(data, peaks, score_measure, n_peaks_influence):
         n_peaks_all (list): Number of peaks in each spectrum. Only if detailed=True
     """
 
-    scores = []
-    n_peaks_all = []
-    scores_peaks = []
-
-    for i, row in enumerate(peaks):
-        n_peaks = len(row)
-        if n_peaks == 0:
-            score = 0
-        elif score_measure == 0:
-            score = 1
-        elif score_measure == 1:  # median height
-            heights = [data.iloc[i, k] for k in row]
-            score = np.median(heights)
-        elif score_measure == 2:  # mean height
-            heights = [data.iloc[i, k] for k in row]
-            score = np.mean(heights)
-        elif score_measure == 3:  # mean area
-            score = simpson(data.iloc[i, :], data.columns) / n_peaks
-        elif score_measure == 4:  # total area
-            score = simpson(data.iloc[i, :], data.columns)
-
-        scores.append(score)
-        n_peaks_all.append(n_peaks)
-
-        if n_peaks == 0:
-            scores_peaks.append(0)
-        elif n_peaks_influence == 0:
-            scores_peaks.append(score)
-        elif n_peaks_influence == 1:
-            scores_peaks.append(n_peaks*score)
-        elif n_peaks_influence == 2:
-            scores_peaks.append(score*(n_peaks**2))
-
-#    n_peaks_all = [n_peaks for _, n_peaks in sorted(
-#        zip(scores_peaks, n_peaks_all))]
-#    n_peaks_all.reverse()
-    return scores_peaks, scores, n_peaks_all
+    if score_measure not in score_names:
+        raise ValueError(f"Score measure {score_measure} does not exist.")
+    if n_peaks_influence not in peak_score_names:
+        raise ValueError(f"Peak influence {n_peaks_influence} does not exist.")
+
+    values = np.asarray(data, dtype=float)
+    peaks = RaggedPeaks.from_lists(peaks)
+    n_peaks = peaks.counts
+    has_peaks = n_peaks > 0
+    scores = np.zeros(len(n_peaks))
+
+    if score_measure == 0:
+        scores[has_peaks] = 1
+
+    elif score_measure == 1 and peaks.heights is None and \
+            (jit_kernels is not None if jit is None else jit):
+        scores = jit_kernels.peak_height_medians(
+            np.ascontiguousarray(values), peaks.indptr,
+            peaks.indices.astype(np.int64))
+
+    elif score_measure in (1, 2):  # median / mean height
+        # Heights of all peaks of all spectra, in consecutive segments
+        rows = peaks.rows
+        heights = peaks.heights if peaks.heights is not None \
+            else values[rows, peaks.indices]
+        starts = peaks.indptr[:-1]
+        starts, counts = starts[has_peaks], n_peaks[has_peaks]
+
+        if score_measure == 1:
+            heights = heights[np.lexsort((heights, rows))]
+            scores[has_peaks] = (heights[starts + (counts - 1) // 2]
+                                 + heights[starts + counts // 2]) / 2
+        else:
+            scores[has_peaks] = np.add.reduceat(heights, starts) / counts
+
+    else:  # mean / total area
+        try:
+            wns = np.asarray(data.columns, dtype=float)
+        except AttributeError:
+            wns = np.arange(values.shape[1])
+        areas = simpson(values[has_peaks], x=wns, axis=1)
+        if score_measure == 3:
+            areas = areas / n_peaks[has_peaks]
+        scores[has_peaks] = areas
+
+    scores_peaks = scores * n_peaks**n_peaks_influence
+
+    return scores_peaks.tolist(), scores.tolist(), n_peaks.tolist()
 
 
 def sort_spectra(data, scores):
@@ -163,37 +280,315 @@ def sort_spectra(data, scores):
     Returns:
         pandas.DataFrame: Sorted data, Class labels are included as the first column.
     """
-    data_sorted = data.copy()
-    data_sorted.insert(0, "score", scores)
-    data_sorted = data_sorted.sort_values("score", ascending=False)
-    data_sorted = data_sorted.reset_index(drop=True)
+    scores = np.asarray(scores, dtype=float)
+    # Spectra with equal scores keep their original order
+    order = np.argsort(-scores, kind="stable")
+
+    data_sorted = data.iloc[order].reset_index(drop=True)
+    data_sorted.insert(0, "score", scores[order])
 
     return data_sorted
 
 
+def _keep_mask(group_ids, rank, scores, n=None, min_n=0, min_score=0):
+    """Which spectra to keep, given their class id (-1 for none) and rank within the class."""
+    if n is not None:
+        keep = rank < n
+    else:
+        keep = scores >= min_score
+        labelled = group_ids >= 0
+        n_kept = np.bincount(group_ids[labelled], weights=keep[labelled],
+                             minlength=group_ids.max(initial=-1) + 1)
+        # The appended 0 is looked up for spectra without a label (id -1)
+        too_few = np.append(n_kept, 0)[group_ids] < min_n
+        keep = np.where(too_few, rank < min_n, keep)
+
+    return keep & (group_ids >= 0)
+
+
+def select_spectra(scores, labels, n=None, min_n=0, min_score=0):
+    """Positions of the spectra that sort_spectra followed by remove_low_quality would return.
+
+    Only the scores and labels are sorted, so the spectra themselves can be
+    taken once afterwards, e.g. with data.iloc[positions].
+
+    Args:
+        scores (array-like): Quality score of each spectrum.
+        labels (array-like): Class label of each spectrum.
+        n (int, optional): Number of spectra to keep per class. Defaults to None.
+        min_n (int, optional): Minimum number of spectra per class if fewer reach min_score. Defaults to 0.
+        min_score (float, optional): Minimum score of the kept spectra. Defaults to 0.
+
+    Returns:
+        numpy.ndarray: Row positions of the selected spectra, in output order.
+    """
+    if min_score == 0 and min_n != 0:
+        raise ValueError("min_n only works in combination with min_score")
+
+    scores = np.asarray(scores, dtype=float)
+    if n is None and min_score == 0:
+        return np.argsort(-scores, kind="stable")
+
+    group_ids, _ = pd.factorize(np.asarray(labels), sort=True)
+    # By class, then by descending score; lexsort is stable for ties
+    order = np.lexsort((-scores, group_ids))
+    group_ids = group_ids[order]
+    rank = np.arange(len(order)) - np.searchsorted(group_ids, group_ids)
+
+    keep = _keep_mask(group_ids, rank, scores[order], n, min_n, min_score)
+    return order[keep]
+
+
 def remove_low_quality(data, n=None, min_n=0, min_score=0):
+    """Keep the first n spectra of each class, or those with a score of at least min_score.
+
+    Args:
+        data (pandas.DataFrame): Spectra sorted by score, with 'label' and 'score' columns.
+        n (int, optional): Number of spectra to keep per class. Defaults to None.
+        min_n (int, optional): Minimum number of spectra per class if fewer reach min_score. Defaults to 0.
+        min_score (float, optional): Minimum score of the kept spectra. Defaults to 0.
+
+    Returns:
+        pandas.DataFrame: Remaining spectra, grouped by class in sorted label order.
+    """
     if min_score == 0 and min_n != 0:
         raise ValueError("min_n only works in combination with min_score")
 
-    data_out = pd.DataFrame(columns=data.columns)
+    if n is None and min_score == 0:
+        return data.reset_index(drop=True)
 
-    if n is not None:
-        for _, group in data.groupby("label"):
-            data_out = pd.concat([data_out, group.iloc[:n, :]])
+    # Select row positions first and take the rows only once at the end
+    groups = data.groupby("label")
+    group_ids = groups.ngroup().fillna(-1).to_numpy(dtype=int)
+    rank = groups.cumcount().to_numpy()
+
+    keep = _keep_mask(group_ids, rank, data.score.to_numpy(dtype=float),
+                      n, min_n, min_score)
+    positions = np.flatnonzero(keep)
+    positions = positions[np.argsort(group_ids[positions], kind="stable")]
+
+    return data.iloc[positions].reset_index(drop=True)
 
-    elif min_score != 0:
-        for _, group in data.groupby("label"):
-            group_out = group.loc[group.score >= min_score, :]
-            if len(group_out) < min_n:
-                group_out = group.iloc[:min_n, :]
-            data_out = pd.concat([data_out, group_out])
 
+def _score_chunk(X, start, stop, wns, bl_method, sg_window, threshold,
+                 min_height, score_measure, n_peaks_influence, cache=None,
+                 profile=None, deriv_dtype=float, deriv_out=None):
+    """Baseline-correct, find the peaks of and score the spectra X[start:stop].
+
+    Every step works on each spectrum independently, so scoring the rows in
+    chunks gives the same result as scoring them all at once. The derivative
+    is written to deriv_out if given, otherwise returned as deriv_dtype, or
+    dropped if deriv_dtype is None.
+    """
+    data = pd.DataFrame(X[start:stop], columns=wns)
+    with optional_stage(profile, "baseline_correction", len(data)):
+        data_bl = baseline_correction(data, method=bl_method, cache=cache)
+    with optional_stage(profile, "peakRecognition", len(data)):
+        peaks, deriv = peakRecognition(data, data_bl, sg_window, bl_method,
+                                       threshold, min_height, cache)
+    with optional_stage(profile, "calc_scores", len(data)):
+        scores, intensity_scores, n_peaks = calc_scores(
+            data_bl, peaks, score_measure, n_peaks_influence)
+
+    if deriv_out is not None:
+        deriv_out[start:stop] = deriv
+        deriv = None
+    elif deriv_dtype is None:
+        deriv = None
     else:
-        data_out = data
+        deriv = deriv.astype(deriv_dtype, copy=False)
+    return scores, intensity_scores, n_peaks, peaks, deriv, profile
 
-    data_out = data_out.reset_index(drop=True)
-    return data_out
 
+def score_spectra(data, bl_method="asls", sg_window=17, threshold=0.5,
+                  min_height=0, score_measure=1, n_peaks_influence=1,
+                  n_jobs=None, chunk_size=None, cache=None, profile=None,
+                  deriv_dtype=float, deriv_out=None):
+    """Score spectra in row chunks, optionally in parallel worker processes.
+
+    Args:
+        data (pandas.DataFrame): Spectra (without label columns), one per row.
+        n_jobs (int, optional): Number of worker processes. None means 1, -1 uses all cores. Defaults to None.
+        chunk_size (int, optional): Number of spectra per chunk. If None, the spectra are split into 4 chunks per worker. Defaults to None.
+        cache (BaselineCache, optional): Cache to reuse baselines of previously corrected spectra. Only used when the chunks are scored in this process (n_jobs=1). Defaults to None.
+        profile (StageProfile, optional): Profile to record the time and memory of each stage in, including those spent in worker processes. Defaults to None.
+        deriv_dtype (dtype, optional): Data type of the returned derivative. If None, the derivative is not kept. Defaults to float.
+        deriv_out (numpy.ndarray, optional): Array (e.g. a numpy.memmap) with the shape of data that the derivative is written to, chunk by chunk, instead of being returned. Workers write to a memmap directly. Defaults to None.
+
+        See score_sort_spectra for the other arguments.
+
+    Returns:
+        scores (list): Overall score for each spectrum.
+        intensity_scores (list): Intensity score for each spectrum.
+        n_peaks (list): Number of peaks in each spectrum.
+        peaks (RaggedPeaks): The peaks found in each spectrum.
+        deriv (numpy.ndarray): First derivative of the spectra, deriv_out if given, or None if deriv_dtype is None.
+    """
+    wns = data.columns
+    X = data.to_numpy(dtype=float)
+    n_jobs = max(1, min(effective_n_jobs(n_jobs), len(X)))
+
+    if chunk_size is None:
+        n_chunks = 1 if n_jobs == 1 else 4 * n_jobs
+    else:
+        n_chunks = -(-len(X) // chunk_size)
+    bounds = np.linspace(0, len(X), max(1, min(n_chunks, len(X))) + 1, dtype=int)
+    params = (wns, bl_method, sg_window, threshold, min_height,
+              score_measure, n_peaks_influence)
+    deriv_params = {"deriv_dtype": deriv_dtype, "deriv_out": deriv_out}
+
+    if n_jobs == 1:
+        results = [_score_chunk(X, start, stop, *params, cache=cache,
+                                profile=profile, **deriv_params)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+    else:
+        # X is passed whole and sliced by the workers: joblib memory-maps
+        # large arrays once, so all workers share the same copy of the data.
+        worker_profile = None if profile is None \
+            else StageProfile(trace_memory=profile.trace_memory)
+        start_time = time.perf_counter()
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_score_chunk)(X, start, stop, *params,
+                                  profile=worker_profile, **deriv_params)
+            for start, stop in zip(bounds[:-1], bounds[1:]))
+        if profile is not None:
+            profile.merge_parallel([result[5] for result in results],
+                                   time.perf_counter() - start_time)
+
+    scores, intensity_scores, n_peaks = [], [], []
+    for chunk_scores, chunk_intensity, chunk_n_peaks, *_ in results:
+        scores += chunk_scores
+        intensity_scores += chunk_intensity
+        n_peaks += chunk_n_peaks
+    peaks = RaggedPeaks.concatenate([result[3] for result in results])
+    if deriv_out is not None:
+        deriv = deriv_out
+    elif deriv_dtype is None:
+        deriv = None
+    else:
+        deriv = np.concatenate([result[4] for result in results])
+
+    return scores, intensity_scores, n_peaks, peaks, deriv
+
+
+class ScoreStore:
+    """Persistent store of spectrum scores.
+
+    Scores are stored per spectrum and keyed by a hash of the spectrum's
+    content, its wavenumbers and the scoring parameters, so spectra that were
+    already scored with the same parameters are not scored again, e.g. when
+    new spectra are added to a dataset.
+
+    Args:
+        path (str, optional): File the store is loaded from (if it exists) and saved to. If None, the store is kept in memory only. Defaults to None.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._store = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, key):
+        return key in self._store
+
+    @staticmethod
+    def make_keys(data, **params):
+        """Create one key per row of data (a DataFrame with the wavenumbers as columns)."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(sorted(params.items())).encode())
+        digest.update(np.asarray(data.columns, dtype=float).tobytes())
+
+        X = np.ascontiguousarray(data, dtype=float)
+        keys = []
+        for row in X:
+            key = digest.copy()
+            key.update(row.tobytes())
+            keys.append(key.digest())
+        return keys
+
+    def get(self, keys):
+        """Return the scores, intensity scores, numbers of peaks and peaks stored for keys."""
+        entries = [self._store[key] for key in keys]
+        scores, intensity_scores, n_peaks, peaks = (list(values) for values in zip(*entries)) \
+            if entries else ([], [], [], [])
+        return scores, intensity_scores, n_peaks, RaggedPeaks.from_lists(peaks)
+
+    def put(self, keys, scores, intensity_scores, n_peaks, peaks):
+        """Store the results of calc_scores and peakRecognition for keys."""
+        peaks = RaggedPeaks.from_lists(peaks)
+        for key, score, intensity_score, n, peak_pos in zip(
+                keys, scores, intensity_scores, n_peaks, peaks):
+            # Copy so that the store does not keep the peaks of other spectra alive
+            self._store[key] = (score, intensity_score, n, np.array(peak_pos))
+
+    def load(self, path):
+        with np.load(path) as f:
+            peaks = RaggedPeaks(f["peak_indptr"], f["peak_indices"])
+            keys = [key.tobytes() for key in f["keys"]]
+            self.put(keys, f["scores"].tolist(),
+                     f["intensity_scores"].tolist(), f["n_peaks"].tolist(), peaks)
+
+    def save(self, path=None):
+        """Write the store to path (or the path it was created with)."""
+        path = self.path if path is None else path
+        keys = list(self._store)
+        scores, intensity_scores, n_peaks, peaks = self.get(keys)
+
+        # Write to a temporary file first so that an interrupted save never
+        # leaves a corrupted store behind
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            # Keys as raw bytes, a bytes dtype would strip trailing zeros
+            np.savez(f, keys=np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, 16),
+                     scores=np.array(scores, dtype=float),
+                     intensity_scores=np.array(intensity_scores, dtype=float),
+                     n_peaks=np.array(n_peaks, dtype=int),
+                     peak_indptr=peaks.indptr,
+                     peak_indices=peaks.indices)
+        os.replace(tmp_path, path)
+
+
+def score_spectra_incremental(data, store, bl_method="asls", sg_window=17,
+                              threshold=0.5, min_height=0, score_measure=1,
+                              n_peaks_influence=1, **kwargs):
+    """Score spectra, reusing the scores of spectra found in a ScoreStore.
+
+    Only spectra that are not in the store are scored. Their results are
+    added to the store, which is saved if it has a path.
+
+    Args:
+        data (pandas.DataFrame): Spectra (without label columns), one per row.
+        store (ScoreStore): Store of previously computed scores.
+        **kwargs: Passed on to score_spectra (n_jobs, chunk_size, cache).
+
+        See score_sort_spectra for the other arguments.
+
+    Returns:
+        scores (list): Overall score for each spectrum.
+        intensity_scores (list): Intensity score for each spectrum.
+        n_peaks (list): Number of peaks in each spectrum.
+        peaks (RaggedPeaks): The peaks found in each spectrum.
+    """
+    keys = store.make_keys(data, bl_method=bl_method, sg_window=sg_window,
+                           threshold=threshold, min_height=min_height,
+                           score_measure=score_measure,
+                           n_peaks_influence=n_peaks_influence)
+    # Duplicates within data only need to be scored once
+    missing = list({key: i for i, key in enumerate(keys) if key not in store}.values())
+
+    if missing:
+        results = score_spectra(data.iloc[missing], bl_method, sg_window,
+                                threshold, min_height, score_measure,
+                                n_peaks_influence, deriv_dtype=None, **kwargs)
+        store.put([keys[i] for i in missing], *results[:4])
+        if store.path is not None:
+            store.save()
+
+    return store.get(keys)
 
 
 def score_sort_spectra(data,
@@ -207,7 +602,14 @@ def score_sort_spectra(data,
                        min_height=0,
                        score_measure=1,
                        n_peaks_influence=1,
-                       detailed=False):
+                       detailed=False,
+                       cache=None,
+                       n_jobs=None,
+                       chunk_size=None,
+                       store=None,
+                       profile=None,
+                       deriv="full",
+                       deriv_path=None):
     """Convenience function for baseline-correcting, scoring and sorting spectral data.
 
     Args:
@@ -219,6 +621,13 @@ def score_sort_spectra(data,
         threshold (float, optional): Threshold value for the second derivative. Potential peaks must have a lower (negative) value than this to be considered proper peaks. Defaults to 0.5.
         score_measure (int, optional): Intensity measure to use for score calculation. 0: None; 1: Median peak height; 2: Mean peak height; 3: Mean peak area; 4: Total peak area. Defaults to 1.
         n_peaks_influence (int, optional): How the number of peaks influences the score. 0: No influence; 1: Multiplicative, 2: Exponential. Defaults to 1.
+        cache (BaselineCache, optional): Cache to reuse baselines across calls, e.g. when sweeping scoring parameters. Only used with n_jobs=1. Defaults to None.
+        n_jobs (int, optional): Number of worker processes used for scoring. None means 1, -1 uses all cores. Defaults to None.
+        chunk_size (int, optional): Number of spectra scored at once, which bounds the memory per worker. If None, the spectra are split into 4 chunks per worker. Defaults to None.
+        store (ScoreStore, optional): Store of previously computed scores. Only spectra that are not in the store are scored, e.g. only the new spectra of a growing dataset. Derivatives are not stored, so with detailed=True it requires deriv=None or "lazy". Defaults to None.
+        profile (StageProfile or callable, optional): Records wall time, CPU time, peak memory and throughput of each stage (limit_range, baseline_correction, peakRecognition, calc_scores, select_spectra). Either a StageProfile that is filled in, or a callable that is called with a new StageProfile at the end of the run. Defaults to None.
+        deriv (str, optional): How the derivative is returned with detailed=True. "full": float64 array; "float32": float32 array; "lazy": a LazyDerivative that computes the rows it is indexed with; "memmap": a float64 numpy.memmap at deriv_path; None: not returned. Combine with chunk_size to also bound the memory used while scoring. Defaults to "full".
+        deriv_path (str, optional): File of the memmap for deriv="memmap". Defaults to None.
 
     Returns:
         pandas.DataFrame: Spectral data sorted by quality score, with low quality spectra optionally removed.
@@ -228,8 +637,14 @@ def score_sort_spectra(data,
 
     if not isinstance(data, pd.DataFrame):
         raise TypeError("Data must be a pandas DataFrame.")
+    if deriv not in ("full", "float32", "lazy", "memmap", None):
+        raise ValueError(f"Unknown derivative output {deriv}.")
+    if deriv == "memmap" and deriv_path is None:
+        raise ValueError("deriv_path is required for deriv='memmap'.")
+    if detailed and store is not None and deriv not in ("lazy", None):
+        raise ValueError("A score store requires deriv=None or 'lazy' with detailed=True.")
 
-    orig_data = data.copy()
+    orig_data = data
 
     labels = data.label
     if "file" in data.columns:
@@ -239,39 +654,194 @@ def score_sort_spectra(data,
 
     data = data.drop(columns=["label", "file"])
 
-    data = limit_range(data, limits)
-
-    data_bl = baseline_correction(data, method=bl_method)
-
-    peaks, deriv = peakRecognition(data, data_bl, sg_window, bl_method, threshold, min_height)
-
-    scores, intensity_scores, n_peaks = calc_scores(
-        data_bl, peaks, score_measure, n_peaks_influence)
-
-    data_sorted = sort_spectra(orig_data, scores)
-
-    data_out = remove_low_quality(
-        data_sorted, n=n, min_n=min_n, min_score=min_score)
+    callback = None
+    if profile is not None and not isinstance(profile, StageProfile):
+        callback, profile = profile, StageProfile()
+
+    with optional_stage(profile, "limit_range", len(data)):
+        data = limit_range(data, limits)
+
+    deriv_dtype = {"full": float, "float32": np.float32}.get(deriv) if detailed else None
+    deriv_out = None
+    if detailed and deriv == "memmap":
+        deriv_out = np.lib.format.open_memmap(deriv_path, mode="w+",
+                                              dtype=float, shape=data.shape)
+
+    if store is None:
+        scores, intensity_scores, n_peaks, peaks, deriv_values = score_spectra(
+            data, bl_method, sg_window, threshold, min_height, score_measure,
+            n_peaks_influence, n_jobs=n_jobs, chunk_size=chunk_size,
+            cache=cache, profile=profile, deriv_dtype=deriv_dtype,
+            deriv_out=deriv_out)
+    else:
+        scores, intensity_scores, n_peaks, peaks = score_spectra_incremental(
+            data, store, bl_method, sg_window, threshold, min_height,
+            score_measure, n_peaks_influence, n_jobs=n_jobs,
+            chunk_size=chunk_size, cache=cache, profile=profile)
 
-    data_out.drop(columns="score", inplace=True)
+    # Sort and select on the scores only, then take the rows once
+    with optional_stage(profile, "select_spectra", len(data)):
+        positions = select_spectra(scores, labels, n=n, min_n=min_n, min_score=min_score)
+        data_out = orig_data.iloc[positions].reset_index(drop=True)
 
     end_time = time.perf_counter()
 
-    print(f"Analyzed {len(data)} spectra in {round(end_time-start_time, 2)} seconds.")
-    print(f"Mean Score: {int(np.mean(scores))}")
-    print()
-    print(f"1st Quartile: {int(np.quantile(scores, 0.25))}")
-    print(f"Median Score: {int(np.median(scores))}")
-    print(f"3rd Quartile: {int(np.quantile(scores, 0.75))}")
-    print()
-    print(f"Min Score: {int(np.min(scores))}")
-    print(f"Max Score: {int(np.max(scores))}")
-
+    scoring_logger.info("Analyzed %d spectra in %.2f seconds.",
+                        len(data), end_time - start_time)
+    if len(scores) and scoring_logger.isEnabledFor(logging.INFO):
+        scoring_logger.info(
+            "Mean Score: %d, 1st Quartile: %d, Median Score: %d, "
+            "3rd Quartile: %d, Min Score: %d, Max Score: %d",
+            np.mean(scores), np.quantile(scores, 0.25), np.median(scores),
+            np.quantile(scores, 0.75), np.min(scores), np.max(scores))
+    if profile is not None:
+        scoring_logger.debug("Stage profile:\n%s", profile)
+    if callback is not None:
+        callback(profile)
 
     if detailed:
-        return data_out, deriv, {"intensity_scores": intensity_scores,
+        if deriv == "lazy":
+            deriv_values = LazyDerivative(data, sg_window, bl_method)
+        elif deriv_out is not None:
+            deriv_out.flush()
+        elif deriv is None:
+            deriv_values = None
+        return data_out, deriv_values, {"intensity_scores": intensity_scores,
                                  "peak_scores": n_peaks,
                                  "total_scores": scores,
                                  "peak_pos": peaks}
     else:
-        return data_out
\ No newline at end of file
+        return data_out
+
+
+# Parameters of score_sort_spectra that can be swept, by the stage that first
+# depends on them
+_SWEEP_STAGES = {"limits": "range",
+                 "bl_method": "baseline",
+                 "sg_window": "derivative",
+                 "threshold": "peaks",
+                 "min_height": "peaks",
+                 "score_measure": "scores",
+                 "n_peaks_influence": "scores",
+                 "n": "selection",
+                 "min_n": "selection",
+                 "min_score": "selection"}
+
+_SWEEP_DEFAULTS = {"limits": (None, None),
+                   "bl_method": "asls",
+                   "sg_window": 17,
+                   "threshold": 0.5,
+                   "min_height": 0,
+                   "score_measure": 1,
+                   "n_peaks_influence": 1,
+                   "n": None,
+                   "min_n": 0,
+                   "min_score": 0}
+
+
+def _sweep_baselines(data, bl_method, cache=None):
+    """Both baselines that scoring needs: of the spectra and of the max-normalized spectra."""
+    data_bl = baseline_correction(data, method=bl_method, cache=cache)
+    data_norm_bl = baseline_correction(normalize(data, norm="max"),
+                                       method=bl_method, cache=cache)
+    return data_bl, data_norm_bl
+
+
+def _sweep_derivative(data_norm_bl, sg_window):
+    return savgol_derivatives(data_norm_bl, sg_window, 3, derivs=(1,))[0]
+
+
+def _sweep_peaks(deriv, data_bl, threshold, min_height):
+    return RaggedPeaks(*find_peak_positions(deriv, data_bl, threshold, min_height))
+
+
+def sweep_scores(data, param_grid, n_jobs=None, cache=None):
+    """Score and select spectra for every combination of a parameter grid.
+
+    Equivalent to calling score_sort_spectra once per combination, but every
+    intermediate result is computed only once and shared by all combinations
+    that depend on it: the range limit per limits, the baselines per
+    bl_method, the derivative per sg_window and the peaks per (threshold,
+    min_height). The cost of a sweep therefore grows with the number of
+    distinct baselines and derivatives rather than with the number of
+    combinations.
+
+    Args:
+        data (pandas.DataFrame): Spectral data with each row representing a spectrum. Class labels (or similar) should be in a column named 'label'.
+        param_grid (dict or list of dicts): Values to try for the arguments of score_sort_spectra (limits, bl_method, sg_window, threshold, min_height, score_measure, n_peaks_influence, n, min_n, min_score), as for sklearn.model_selection.ParameterGrid. Arguments not in the grid keep their defaults.
+        n_jobs (int, optional): Number of worker processes used for the baselines, derivatives and peaks of each stage. None means 1, -1 uses all cores. Defaults to None.
+        cache (BaselineCache, optional): Cache to reuse baselines across calls. Only used with n_jobs=1. Defaults to None.
+
+    Returns:
+        list: One dict per combination with the keys "params" (all scoring parameters), "positions" (row positions of the selected spectra in data, in output order, i.e. the output of score_sort_spectra is data.iloc[positions]), "total_scores", "intensity_scores" and "peak_scores".
+    """
+    if not isinstance(data, pd.DataFrame):
+        raise TypeError("Data must be a pandas DataFrame.")
+
+    combinations = []
+    for params in ParameterGrid(param_grid):
+        unknown = set(params) - set(_SWEEP_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Cannot sweep over {sorted(unknown)}.")
+        combinations.append({**_SWEEP_DEFAULTS, **params})
+
+    labels = data.label
+    spectra = data.drop(columns=["label", "file"])
+
+    def stage_key(params, stage):
+        """Parameters that the result of stage depends on, in a hashable form."""
+        order = list(_SWEEP_STAGES.values())
+        return tuple((name, repr(params[name]))
+                     for name, name_stage in _SWEEP_STAGES.items()
+                     if order.index(name_stage) <= order.index(stage))
+
+    def unique(stage):
+        """The combinations with distinct results at stage, by key."""
+        return {stage_key(params, stage): params for params in combinations}
+
+    def run(func, tasks):
+        """Call func(*args) for all tasks (a dict key: args) and collect results by key."""
+        n_workers = max(1, min(effective_n_jobs(n_jobs), len(tasks)))
+        if n_workers == 1:
+            return {key: func(*args) for key, args in tasks.items()}
+        results = Parallel(n_jobs=n_workers)(
+            delayed(func)(*args) for args in tasks.values())
+        return dict(zip(tasks, results))
+
+    limited = {key: limit_range(spectra, params["limits"])
+               for key, params in unique("range").items()}
+
+    baseline_cache = cache if effective_n_jobs(n_jobs) == 1 else None
+    baselines = run(_sweep_baselines, {
+        key: (limited[stage_key(params, "range")], params["bl_method"], baseline_cache)
+        for key, params in unique("baseline").items()})
+
+    derivs = run(_sweep_derivative, {
+        key: (baselines[stage_key(params, "baseline")][1], params["sg_window"])
+        for key, params in unique("derivative").items()})
+
+    peaks = run(_sweep_peaks, {
+        key: (derivs[stage_key(params, "derivative")],
+              baselines[stage_key(params, "baseline")][0],
+              params["threshold"], params["min_height"])
+        for key, params in unique("peaks").items()})
+    del derivs
+
+    scores = {key: calc_scores(baselines[stage_key(params, "baseline")][0],
+                               peaks[stage_key(params, "peaks")],
+                               params["score_measure"],
+                               params["n_peaks_influence"])
+              for key, params in unique("scores").items()}
+
+    results = []
+    for params in combinations:
+        total_scores, intensity_scores, n_peaks = scores[stage_key(params, "scores")]
+        positions = select_spectra(total_scores, labels, n=params["n"],
+                                   min_n=params["min_n"],
+                                   min_score=params["min_score"])
+        results.append({"params": params,
+                        "positions": positions,
+                        "total_scores": total_scores,
+                        "intensity_scores": intensity_scores,
+                        "peak_scores": n_peaks})
+    return results
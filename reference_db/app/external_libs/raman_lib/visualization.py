@@ -9,13 +9,17 @@ from IPython.display import display
 from ipywidgets import Button, HBox
 from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
 from scipy.signal import find_peaks
-from sklearn.metrics import auc, confusion_matrix, roc_curve
+
+from .peaks import RaggedPeaks
+from .results import confusion_matrices, mean_roc_curve, roc_auc, roc_curves
 
 
 def plot_spectra_peaks(wns, signal, deriv, peaks, scores, labels=None):
 
+    wns = np.asarray(wns)
     signal = np.asarray(signal)
     deriv = np.asarray(deriv)
+    peaks = RaggedPeaks.from_lists(peaks)
     fig, (ax1, ax2) = plt.subplots(2,1)
     #plt.subplots_adjust(bottom=0.2)
 
@@ -51,8 +55,7 @@ def plot_spectra_peaks(wns, signal, deriv, peaks, scores, labels=None):
             ydata = signal[i, :]
             line1.set_ydata(ydata)
 
-            marks = np.array([[wns[peak], signal[i][peak]]
-                             for peak in peaks[i]])
+            marks = np.column_stack((wns[peaks[i]], signal[i, peaks[i]]))
             if len(marks) == 0:
                 peakmarks.set_visible(False)
             else:
@@ -78,8 +81,7 @@ def plot_spectra_peaks(wns, signal, deriv, peaks, scores, labels=None):
             ydata = signal[i, :]
             line1.set_ydata(ydata)
 
-            marks = np.array([[wns[peak], signal[i][peak]]
-                             for peak in peaks[i]])
+            marks = np.column_stack((wns[peaks[i]], signal[i, peaks[i]]))
             if len(marks) == 0:
                 peakmarks.set_visible(False)
             else:
@@ -259,9 +261,7 @@ def plot_confusion_matrix(y_pred, y_true, labels= (0, 1), ax=None, colorbar=Fals
     if not isinstance(y_pred, np.ndarray):
         y_pred = np.asarray(y_pred)
 
-    conf_matrices = np.asarray(
-        [confusion_matrix(y_true, y_pred[i, :]) for i in range(len(y_pred))]
-    )
+    conf_matrices = confusion_matrices(y_true, y_pred)
 
     conf_matrix_plot = conf_matrices.mean(axis=0)
     vmax = conf_matrix_plot.sum(axis=1).max()
@@ -307,25 +307,15 @@ def plot_roc_curve(conf_scores, y, label, ax=None):
 
     if not isinstance(conf_scores, np.ndarray):
         conf_scores = np.asarray(conf_scores)
-    mean_fpr = np.linspace(0, 1, 200)
-    aucs = []
-    tprs = []
+    fpr, tpr = roc_curves(y, conf_scores)
+    mean_fpr, _, mean_tpr = mean_roc_curve(fpr, tpr)
+    aucs = roc_auc(fpr, tpr)
 
     if ax is None:
         ax = plt.gca()
 
     ax.plot([0, 1], [0, 1], color="k", linestyle="--")
-
-    for row in conf_scores:
-        fpr, tpr, _ = roc_curve(y, row)
-        ax.plot(fpr, tpr, color="k", alpha=0.2, linewidth=1)
-        aucs.append(auc(fpr, tpr))
-        tpr_interp = np.interp(mean_fpr, fpr, tpr)
-        tpr_interp[0] = 0.0
-        tprs.append(tpr_interp)
-
-    mean_tpr = np.mean(tprs, axis=0)
-    mean_tpr[-1] = 1
+    ax.plot(fpr.T, tpr.T, color="k", alpha=0.2, linewidth=1)
 
     aucs_mean = np.mean(aucs)
     aucs_std = np.std(aucs)
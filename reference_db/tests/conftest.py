@@ -0,0 +1,5 @@
+import os
+import sys
+
+# raman_lib is vendored in the app rather than installed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "app", "external_libs"))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from pybaselines.whittaker import arpls, asls
+
+from raman_lib import baselines
+from raman_lib.baselines import arpls_batch, asls_batch
+
+
+def _spectra(n, p=300, seed=0):
+    """Peaks on a curved background with noise."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, p)
+    background = rng.uniform(1, 5, (n, 1)) * (x - rng.uniform(0, 1, (n, 1)))**2
+    centers = rng.uniform(0.1, 0.9, (n, 4))
+    peaks = np.exp(-((x[None, None, :] - centers[..., None]) / 0.01)**2).sum(axis=1)
+    return 100 * background + 50 * peaks + rng.normal(scale=0.5, size=(n, p))
+
+
+def _close(bl, expected, rtol=1e-6):
+    scale = np.abs(expected).max(axis=1, keepdims=True)
+    return np.abs(bl - expected).max() <= rtol * scale.max()
+
+
+# More rows than _BATCH_MIN_ROWS, so the batched solver is used
+@pytest.mark.parametrize("n_rows", [3, baselines._BATCH_MIN_ROWS + 10])
+def test_asls_batch_matches_pybaselines(n_rows):
+    X = _spectra(n_rows)
+    expected = np.array([asls(x, lam=1e5, p=0.01)[0] for x in X])
+    assert _close(asls_batch(X, lam=1e5, p=0.01), expected)
+
+
+@pytest.mark.parametrize("n_rows", [3, baselines._BATCH_MIN_ROWS + 10])
+def test_arpls_batch_matches_pybaselines(n_rows):
+    X = _spectra(n_rows, seed=1)
+    expected = np.array([arpls(x, lam=1e5)[0] for x in X])
+    assert _close(arpls_batch(X, lam=1e5), expected)
+
+
+@pytest.mark.parametrize("diff_order", [1, 2, 3])
+def test_batched_solve_matches_single_solves(diff_order):
+    rng = np.random.default_rng(2)
+    Y = _spectra(20, p=150)
+    W = rng.uniform(0, 1, Y.shape)
+    W[0, 20:120] = 0             # points without data
+    penalty = baselines.whittaker_penalty(Y.shape[1], 1e4, diff_order)
+
+    Z = baselines._solve_whittaker_batch(penalty, W, Y)
+    expected = np.array([baselines._solve_whittaker(penalty, w, y) for w, y in zip(W, Y)])
+    np.testing.assert_allclose(Z, expected, rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.skipif(baselines.jit_kernels is None, reason="numba is not installed")
+def test_jit_matches_pybaselines():
+    X = _spectra(5, seed=3)
+    assert _close(baselines.asls_jit(X, lam=1e5, p=0.01),
+                  np.array([asls(x, lam=1e5, p=0.01)[0] for x in X]))
+    assert _close(baselines.arpls_jit(X, lam=1e5),
+                  np.array([arpls(x, lam=1e5)[0] for x in X]))
@@ -0,0 +1,126 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import Normalizer
+
+from raman_lib.baselines import baseline_backends, register_backend
+from raman_lib.preprocessing import (BLOCK_BYTES, BaselineCorrector, FusedPipeline,
+                                     PeakPicker, RangeLimiter, SavGolFilter)
+
+
+def _spectra(n_spectra, n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, n_points)
+    peaks = np.exp(-((x - rng.uniform(0.2, 0.8, (n_spectra, 1))) / 0.02)**2)
+    return 5 * x + 10 * peaks + rng.normal(scale=0.1, size=(n_spectra, n_points))
+
+
+TRANSFORMERS = [
+    lambda **kw: BaselineCorrector("asls", **kw),
+    lambda **kw: BaselineCorrector("arpls", **kw),
+    lambda **kw: SavGolFilter(**kw),
+]
+
+
+@pytest.mark.parametrize("make", TRANSFORMERS)
+def test_in_place_transform_allocates_one_block(make):
+    # About eight blocks of 4 MiB, so a full copy would be easy to spot
+    X = _spectra(4000, 1000)
+    expected = make().fit_transform(X)
+    transformer = make(copy=False).fit(X)
+
+    tracemalloc.start()
+    result = transformer.transform(X)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert result is X
+    # The result of one block and a few temporaries, far below a copy of X
+    assert peak < 3 * BLOCK_BYTES < X.nbytes / 2
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("make", TRANSFORMERS)
+def test_out_matches_copy(make):
+    X = _spectra(300, 500)
+    out = np.empty_like(X)
+
+    result = make().fit(X).transform(X, out=out)
+
+    assert result is out
+    np.testing.assert_allclose(out, make().fit_transform(X), rtol=1e-12, atol=1e-9)
+
+
+def test_out_must_match_shape():
+    X = _spectra(10, 200)
+    with pytest.raises(ValueError):
+        SavGolFilter().fit(X).transform(X, out=np.empty((10, 100)))
+
+
+def test_parallel_baselines_match_serial():
+    X = _spectra(200, 500)
+    serial = BaselineCorrector("asls").fit_transform(X)
+    parallel = BaselineCorrector("asls", n_jobs=2).fit_transform(X)
+    np.testing.assert_allclose(parallel, serial, rtol=1e-12, atol=1e-9)
+
+
+def test_fused_pipeline_partial_fit_checks_width():
+    pipe = FusedPipeline([("sg", SavGolFilter()), ("bl", BaselineCorrector())])
+    pipe.partial_fit(_spectra(5, 200))
+    pipe.partial_fit(_spectra(5, 200, seed=1))
+    with pytest.raises(ValueError):
+        pipe.partial_fit(_spectra(5, 150))
+
+
+def _linear_baselines(X):
+    """Straight line between the end points of each spectrum."""
+    t = np.linspace(0, 1, X.shape[1])
+    return X[:, :1] + (X[:, -1:] - X[:, :1]) * t
+
+
+@pytest.fixture
+def linear_method():
+    register_backend("linear", "numpy", _linear_baselines)
+    yield "linear"
+    del baseline_backends["linear"]
+
+
+def test_registered_method_uses_its_backend(linear_method):
+    X = _spectra(20, 200)
+    corrected = BaselineCorrector(linear_method).fit_transform(X)
+    assert np.allclose(corrected[:, [0, -1]], 0)
+
+
+def test_unknown_engine_lists_available_engines(linear_method):
+    with pytest.raises(ValueError, match="numpy"):
+        BaselineCorrector(linear_method, engine="numba").fit_transform(_spectra(5, 200))
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_fused_pipeline_matches_chained_steps(copy):
+    def steps():
+        return [("lim", RangeLimiter(lim=(420, 780), reference=np.arange(400, 800))),
+                ("bl", BaselineCorrector(copy=copy)),
+                ("sg", SavGolFilter(copy=copy)),
+                ("norm", Normalizer())]
+
+    X = _spectra(300, 400)
+    X_orig = X.copy()
+    expected = Pipeline(steps()).fit_transform(X.copy())
+
+    fused = FusedPipeline(steps(), block_bytes=2**14).fit(X)
+    np.testing.assert_array_equal(X, X_orig)
+    np.testing.assert_allclose(fused.transform(X), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_peak_area_window():
+    X = _spectra(10, 200)
+    picker = PeakPicker(area_window=5).fit(X)
+    i = np.flatnonzero((picker.peak_indices >= 2) & (picker.peak_indices < 198))[0]
+    peak = picker.peak_indices[i]
+    np.testing.assert_allclose(picker.transform(X)[:, i],
+                               X[:, peak - 2:peak + 3].sum(axis=1))
+    with pytest.raises(ValueError, match="odd"):
+        PeakPicker(area_window=4).fit(X)
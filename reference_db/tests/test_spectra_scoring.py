@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import argrelmax, argrelmin
+
+from raman_lib.peaks import RaggedPeaks
+from raman_lib.spectra_scoring import calc_scores, find_peak_positions
+
+pytest.importorskip("numba")
+
+
+def _edge_cases(n_points=120, seed=0):
+    """Derivatives and baseline-corrected spectra, one case per row."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 4 * np.pi, n_points)
+
+    data = [np.abs(rng.normal(size=n_points)) * 10 for _ in range(6)]
+    data.append(np.full(n_points, np.nan))                      # NaN row
+    row = 5 + 5 * np.sin(x)
+    row[40:45] = np.nan                                         # some NaNs
+    data.append(row)
+    data.append(np.round(5 + 5 * np.sin(x)))                   # flat segments
+    data.append(np.zeros(n_points))                             # no peaks
+    data.append(np.linspace(0, 10, n_points))                   # monotonic
+    data.append(np.where(np.sin(x) > 0, 5 + 5 * np.sin(x), 0))  # zero stretches
+    data = np.array(data)
+
+    deriv = np.gradient(data, axis=1)
+    deriv[9] = 0                                                # exactly zero
+    deriv[10, 10:30] = 0                                        # zero runs
+    deriv[11, ::7] = 0                                          # isolated zeros
+    deriv[0] = np.round(deriv[0])                               # ties
+    return deriv, data
+
+
+@pytest.mark.parametrize("threshold, min_height", [(0, 0), (0.5, 0), (0, 3), (2, 5)])
+def test_peak_positions_jit_matches_numpy(threshold, min_height):
+    deriv, data = _edge_cases()
+    indptr, indices = find_peak_positions(deriv, data, threshold, min_height, jit=False)
+    indptr_jit, indices_jit = find_peak_positions(deriv, data, threshold, min_height, jit=True)
+
+    np.testing.assert_array_equal(indptr_jit, indptr)
+    np.testing.assert_array_equal(indices_jit, indices)
+    # The cases include spectra without peaks
+    assert (np.diff(indptr) == 0).any()
+
+
+def test_peak_positions_jit_matches_numpy_random():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        data = np.round(rng.normal(size=(15, 80)).cumsum(axis=1), 1)
+        deriv = np.round(np.gradient(data, axis=1), 1)
+        results = [find_peak_positions(deriv, data, 0.1, 0, jit=jit)
+                   for jit in (False, True)]
+        np.testing.assert_array_equal(results[1][0], results[0][0])
+        np.testing.assert_array_equal(results[1][1], results[0][1])
+
+
+def _peaks_per_row(deriv, data_bl, threshold, min_height):
+    """The row-by-row algorithm find_peak_positions replaced, as a reference."""
+    peaks = []
+    for i, row in enumerate(deriv):
+        row_peaks = np.where(np.diff(np.sign(row)))[0]
+        if len(row_peaks) == 0:
+            # The old loop raised an IndexError here
+            peaks.append([])
+            continue
+        row_max = argrelmax(row)[0]
+        row_min = argrelmin(row)[0]
+        row_max = [j for j in row_max if row[j] > threshold and j < row_peaks[-1]]
+        row_min = [j for j in row_min if row[j] < -threshold and j > row_peaks[0]]
+
+        peaks_max = np.searchsorted(row_peaks, row_max)
+        peaks_min = np.searchsorted(row_peaks, row_min) - 1
+        peaks_tmp = np.unique(np.concatenate((peaks_max, peaks_min))).astype(int)
+        row_peaks = row_peaks[peaks_tmp]
+
+        peaks.append([j for j in row_peaks if data_bl[i, j:j+1].mean() >= min_height])
+    return peaks
+
+
+@pytest.mark.parametrize("jit", [False, True])
+@pytest.mark.parametrize("threshold, min_height", [(0, 0), (0.5, 0), (0, 3), (2, 5)])
+def test_peak_positions_match_per_row_algorithm(jit, threshold, min_height):
+    deriv, data = _edge_cases()
+    rng = np.random.default_rng(2)
+    walk = np.round(rng.normal(size=(30, 120)).cumsum(axis=1), 1)
+    walk[::3, 40:60] = walk[::3, 40:41]                         # flat segments
+    deriv = np.vstack([deriv, np.round(np.gradient(walk, axis=1), 1)])
+    data = np.vstack([data, walk])
+
+    indptr, indices = find_peak_positions(deriv, data, threshold, min_height, jit=jit)
+    expected = _peaks_per_row(deriv, data, threshold, min_height)
+
+    assert [list(indices[a:b]) for a, b in zip(indptr[:-1], indptr[1:])] == expected
+    # The cases include rows without any zero crossing
+    assert any(len(np.where(np.diff(np.sign(row)))[0]) == 0 for row in deriv)
+
+
+@pytest.mark.parametrize("score_measure", [0, 1, 2, 3, 4])
+@pytest.mark.parametrize("n_peaks_influence", [0, 1, 2])
+def test_scores_jit_matches_numpy(score_measure, n_peaks_influence):
+    deriv, data = _edge_cases()
+    peaks = RaggedPeaks(*find_peak_positions(deriv, data, jit=False))
+    data = pd.DataFrame(data)
+
+    results = calc_scores(data, peaks, score_measure, n_peaks_influence, jit=False)
+    results_jit = calc_scores(data, peaks, score_measure, n_peaks_influence, jit=True)
+
+    for result, result_jit in zip(results, results_jit):
+        np.testing.assert_array_equal(result_jit, result)